@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2022, Devops Parity <devops@parity.io>
+# GPL-2.0-or-later
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+
+class ModuleDocFragment(object):
+
+    DOCUMENTATION = r'''
+options:
+    metadata_cache_dir:
+        description:
+          - Directory on the target where the runtime metadata is cached, keyed by the genesis hash and the runtime
+            spec version. Runs against a known runtime skip the download of the metadata, the cached SCALE bytes
+            are decoded.
+          - An empty string disables the cache.
+        required: false
+        type: path
+        default: '~/.cache/paritytech.chain/metadata'
+        version_added: "1.10.13"
+    metadata_cache_warm:
+        description:
+          - Only load the metadata of the current runtime into the cache and exit, other options are ignored.
+          - C(changed) is true if the metadata was downloaded.
+        required: false
+        type: bool
+        default: false
+        version_added: "1.10.13"
+'''
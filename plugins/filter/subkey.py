@@ -3,8 +3,26 @@
 
 from ansible.errors import AnsibleFilterError
 from ansible.module_utils._text import to_text
+from ansible.module_utils.parsing.convert_bool import boolean
+from ansible.utils.display import Display
+from concurrent.futures import ThreadPoolExecutor
 import subprocess
+import threading
+import tempfile
+import fcntl
+import hashlib
+import hmac
 import json
+import os
+import re
+
+try:
+    from substrateinterface import Keypair, KeypairType
+    from substrateinterface.utils.ss58 import ss58_encode, ss58_decode
+
+    python_substrateinterface_installed = True
+except ImportError:
+    python_substrateinterface_installed = False
 
 DOCUMENTATION = '''
 name: subkey_inspect
@@ -16,6 +34,11 @@ description:
     - Supports various networks and schemes
     - Can output public key information
     - Returns JSON formatted data about the key
+    - Results are memoized in the controller process. Secret URIs are keyed by a salted hash and are never written to disk
+    - Results of public lookups can be cached in a JSON file which is set by the SUBKEY_INSPECT_CACHE environment variable
+    - Cache hits and misses are shown with -vvv
+    - If substrate-interface is installed, sr25519 and ed25519 keys are inspected in-process. The subkey binary is used
+      for ecdsa keys, derivation paths (e.g. '//Alice'), passwords and networks which the native backend doesn't know
 options:
     uri:
         description: The URI or key to inspect
@@ -36,6 +59,14 @@ options:
         type: bool
         required: false
         default: false
+    backend:
+        description:
+          - C(auto) uses the native backend if it supports the input and subkey otherwise,
+            C(native) fails on unsupported input, C(subkey) always runs the binary
+          - The default is taken from the SUBKEY_INSPECT_BACKEND environment variable or is C(auto)
+        type: str
+        required: false
+        choices: ['auto', 'native', 'subkey']
 '''
 
 EXAMPLES = '''
@@ -65,13 +96,251 @@ account_id:
     description: The account ID
     type: str
     sample: "d43593c715fdd31c61141abd04a99fd6822c8558854ccde39a5684e7a56da27d"
+network_id:
+    description: The name of the SS58 address format, e.g. substrate, polkadot or kusama
+    type: str
+    sample: "substrate"
+ss58_public_key:
+    description: The SS58 form of the public key
+    type: str
+    sample: "5GrwvaEF5zXb26Fz9rcQpDWS57CtERHpNehXCPcNoHGKutQY"
 '''
 
 
-def subkey_inspect(uri, network='', scheme='', public=False):
-    """Run subkey inspect command and return output."""
+display = Display()
+
+# SS58 address formats of the networks which are known by the native backend.
+# The names are the ones subkey accepts for --network and are matched as they are, other names are left to subkey
+SS58_NETWORKS = {
+    '': 42,
+    'substrate': 42,
+    'polkadot': 0,
+    'kusama': 2,
+}
+# names of the SS58 address formats which subkey returns as networkId
+SS58_FORMAT_NAMES = {
+    0: 'polkadot',
+    2: 'kusama',
+    42: 'substrate',
+}
+HEX_KEY_RE = re.compile(r'^0x[0-9a-fA-F]{64}$')
+
+# the salt only lives in the memory of the process, so the cache keys of secret URIs can't be reversed
+_cache_salt = os.urandom(32)
+_cache = {}
+_cache_lock = threading.Lock()
+_cache_stats = {'hits': 0, 'misses': 0, 'persistent_hits': 0}
+_persistent_cache = None
+
+
+def _cache_key(uri, network, scheme, public):
+    if public:
+        return 'public', uri, network, scheme
+    return 'secret', hmac.new(_cache_salt, uri.encode(), hashlib.sha256).hexdigest(), network, scheme
+
+
+def _persistent_cache_key(uri, network, scheme):
+    return json.dumps([uri, network, scheme])
+
+
+def _load_persistent_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        display.warning('subkey_inspect cache %s is ignored: %s' % (path, e))
+        return {}
+
+
+def _save_persistent_cache(path, key, output):
+    """
+    Merge the result into the cache file and return the merged cache. Parallel forks update the file,
+    so it's read again and replaced under an exclusive lock of '<path>.lock'
+    """
+    data = {key: output}
+    try:
+        with open(path + '.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            data = _load_persistent_cache(path)
+            data[key] = output
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)), prefix='.subkey-cache-')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(data, f)
+            os.replace(tmp, path)
+    except OSError as e:
+        display.warning('subkey_inspect cache %s can not be written: %s' % (path, e))
+    return data
+
+
+def _log_cache(result, uri):
+    display.vvv('subkey_inspect: cache %s for %s (hits: %d, persistent hits: %d, misses: %d)'
+                % (result, uri, _cache_stats['hits'], _cache_stats['persistent_hits'], _cache_stats['misses']))
+
+
+class UnsupportedInput(Exception):
+    """The input can't be inspected by the native backend"""
+
+
+def _to_hex(value):
+    if isinstance(value, bytes):
+        return '0x' + value.hex()
+    return '0x' + value.lower().replace('0x', '')
+
+
+def _native_inspect(uri, network='', scheme='', public=False):
+    """Inspect the key in-process, returns the same fields as subkey inspect."""
+    if not python_substrateinterface_installed:
+        raise UnsupportedInput('substrate-interface is not installed')
+    crypto_types = {'': KeypairType.SR25519, 'sr25519': KeypairType.SR25519, 'ed25519': KeypairType.ED25519}
+    if scheme.lower() not in crypto_types:
+        raise UnsupportedInput("scheme '%s' is not supported" % scheme)
+    if network not in SS58_NETWORKS:
+        raise UnsupportedInput("network '%s' is not known" % network)
+    crypto_type = crypto_types[scheme.lower()]
+    ss58_format = SS58_NETWORKS[network]
+
+    if public:
+        if HEX_KEY_RE.match(uri):
+            public_key = uri.lower()
+        else:
+            try:
+                public_key = _to_hex(ss58_decode(uri))
+            except Exception:
+                raise UnsupportedInput('the public key is neither hex nor SS58')
+        ss58_address = ss58_encode(public_key, ss58_format)
+        return {'accountId': public_key, 'networkId': SS58_FORMAT_NAMES[ss58_format], 'publicKey': public_key,
+                'ss58Address': ss58_address, 'ss58PublicKey': ss58_address}
+
+    # the seed of derived keys isn't known to substrate-interface
+    if '/' in uri:
+        raise UnsupportedInput('derivation paths and passwords are not supported')
+    if HEX_KEY_RE.match(uri):
+        keypair = Keypair.create_from_seed(uri, ss58_format=ss58_format, crypto_type=crypto_type)
+        output = {'secretKeyUri': uri}
+    else:
+        try:
+            valid = Keypair.validate_mnemonic(uri)
+        except Exception:
+            valid = False
+        if not valid:
+            raise UnsupportedInput('the secret is neither a hex seed nor a valid mnemonic')
+        keypair = Keypair.create_from_mnemonic(uri, ss58_format=ss58_format, crypto_type=crypto_type)
+        output = {'secretPhrase': uri}
+    public_key = _to_hex(keypair.public_key)
+    # the account of sr25519 and ed25519 keys is the public key, so both SS58 forms are the same
+    output.update({'secretSeed': _to_hex(keypair.seed_hex),
+                   'networkId': SS58_FORMAT_NAMES[ss58_format],
+                   'publicKey': public_key,
+                   'accountId': public_key,
+                   'ss58Address': keypair.ss58_address,
+                   'ss58PublicKey': keypair.ss58_address})
+    return output
+
+
+def _inspect(uri, network, scheme, public, backend):
+    if backend != 'subkey':
+        try:
+            return _native_inspect(uri, network, scheme, public)
+        except UnsupportedInput as e:
+            if backend == 'native':
+                raise AnsibleFilterError('The native backend can not inspect the key: %s' % e)
+            display.vvvv('subkey_inspect: the subkey binary is used, %s' % e)
+    return _run_subkey_inspect(uri, network, scheme, public)
+
+
+def subkey_inspect(uri, network='', scheme='', public=False, backend=None):
+    """Return the output of subkey inspect, memoized by (uri, network, scheme, public)."""
+    global _persistent_cache
     uri = to_text(uri, errors='surrogate_or_strict', nonstring='simplerepr')
+    try:
+        public = boolean(public)
+    except TypeError as e:
+        raise AnsibleFilterError('public of subkey_inspect: %s' % e)
+    log_uri = uri if public else '<URI>'
+    key = _cache_key(uri, network, scheme, public)
+    persistent_path = os.environ.get('SUBKEY_INSPECT_CACHE') if public else None
 
+    with _cache_lock:
+        if key in _cache:
+            _cache_stats['hits'] += 1
+            _log_cache('hit', log_uri)
+            return dict(_cache[key])
+        if persistent_path:
+            if _persistent_cache is None:
+                _persistent_cache = _load_persistent_cache(persistent_path)
+            output = _persistent_cache.get(_persistent_cache_key(uri, network, scheme))
+            if output is not None:
+                _cache[key] = output
+                _cache_stats['persistent_hits'] += 1
+                _log_cache('hit (persistent)', log_uri)
+                return dict(output)
+
+    backend = backend or os.environ.get('SUBKEY_INSPECT_BACKEND') or 'auto'
+    if backend not in ('auto', 'native', 'subkey'):
+        raise AnsibleFilterError("backend has to be 'auto', 'native' or 'subkey', got '%s'" % backend)
+    output = _inspect(uri, network, scheme, public, backend)
+
+    with _cache_lock:
+        _cache[key] = output
+        _cache_stats['misses'] += 1
+        _log_cache('miss', log_uri)
+        if persistent_path:
+            merged = _save_persistent_cache(persistent_path, _persistent_cache_key(uri, network, scheme), output)
+            _persistent_cache.update(merged)
+    return dict(output)
+
+
+def subkey_inspect_many(items, network='', scheme='', public=False, backend=None, workers=8):
+    """Inspect a list of keys in parallel, return the results in order."""
+    if not isinstance(items, (list, tuple)):
+        raise AnsibleFilterError('subkey_inspect_many expects a list, got %s' % type(items).__name__)
+    try:
+        workers = int(workers)
+    except (TypeError, ValueError):
+        raise AnsibleFilterError("workers has to be an integer, got '%s'" % workers)
+    if workers < 1:
+        raise AnsibleFilterError('workers has to be positive, got %d' % workers)
+    try:
+        public = boolean(public)
+    except TypeError as e:
+        raise AnsibleFilterError('public of subkey_inspect_many: %s' % e)
+
+    requests = []
+    for i, item in enumerate(items):
+        if isinstance(item, dict):
+            if 'uri' not in item:
+                raise AnsibleFilterError("item %d of subkey_inspect_many has no 'uri' key" % i)
+            try:
+                item_public = boolean(item.get('public', public))
+            except TypeError as e:
+                raise AnsibleFilterError('public of item %d of subkey_inspect_many: %s' % (i, e))
+            request = (to_text(item['uri'], errors='surrogate_or_strict', nonstring='simplerepr'),
+                       item.get('network', network) or '',
+                       item.get('scheme', scheme) or '',
+                       item_public)
+        else:
+            request = (to_text(item, errors='surrogate_or_strict', nonstring='simplerepr'),
+                       network or '', scheme or '', public)
+        requests.append(request)
+
+    def inspect(request):
+        uri, item_network, item_scheme, item_public = request
+        try:
+            return subkey_inspect(uri, item_network, item_scheme, item_public, backend)
+        except Exception as e:
+            return {'failed': True, 'msg': to_text(e)}
+
+    unique = list(dict.fromkeys(requests))
+    with ThreadPoolExecutor(max_workers=min(workers, len(unique)) or 1) as executor:
+        results = dict(zip(unique, executor.map(inspect, unique)))
+    display.vvv('subkey_inspect_many: %d items, %d unique' % (len(requests), len(unique)))
+    return [dict(results[request]) for request in requests]
+
+
+def _run_subkey_inspect(uri, network='', scheme='', public=False):
+    """Run subkey inspect command and return output."""
     args = []
     log_uri = '<URI>'
     if scheme:
@@ -114,5 +383,6 @@ class FilterModule(object):
 
     def filters(self):
         return {
-            'subkey_inspect': subkey_inspect
+            'subkey_inspect': subkey_inspect,
+            'subkey_inspect_many': subkey_inspect_many,
         }
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2022, Devops Parity <devops@parity.io>
+# GPL-2.0-or-later
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import os
+import tempfile
+import traceback
+
+try:
+    from substrateinterface import SubstrateInterface
+    from substrateinterface.storage import StorageKey
+    from scalecodec.base import ScaleBytes
+
+    python_substrateinterface_installed = True
+except ImportError:
+    python_substrateinterface_installed = False
+
+
+# number of storage keys in one state_queryStorageAt request
+QUERY_BATCH_SIZE = 500
+# state_getKeysPaged returns at most 1000 keys
+QUERY_MAP_PAGE_SIZE = 1000
+
+SUBSTRATE_ARGUMENT_SPEC = dict(
+    metadata_cache_dir=dict(type='path', default='~/.cache/paritytech.chain/metadata'),
+    metadata_cache_warm=dict(type='bool', default=False),
+)
+
+
+def _write_atomic(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+
+
+class MetadataFileCache:
+    """
+    On-disk store of the runtime metadata, substrate-interface uses it as a dogpile cache region.
+    substrate-interface keys the metadata by the spec version, the cache keeps one directory per genesis hash.
+
+    The raw SCALE bytes of the metadata are stored, so the next run skips the download but still decodes them.
+    The decoded metadata can't be stored, scalecodec creates its type classes at runtime and they can't be pickled.
+    The metadata is only loaded from a directory which is owned by the current user and isn't writable by others.
+    """
+
+    def __init__(self, path, genesis_hash, substrate):
+        self.path = os.path.join(os.path.expanduser(path), genesis_hash)
+        self.substrate = substrate
+        self.stats = {'path': self.path, 'hits': 0, 'misses': 0}
+
+    def _trusted(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return False
+        return st.st_uid == os.getuid() and not st.st_mode & 0o022
+
+    def get(self, key):
+        if not self._trusted():
+            self.stats['misses'] += 1
+            return None
+        try:
+            with open(os.path.join(self.path, key + '.scale'), 'rb') as f:
+                data = f.read()
+            metadata = self.substrate.runtime_config.create_scale_object(
+                'MetadataVersioned', data=ScaleBytes(bytearray(data))
+            )
+            metadata.decode()
+        except Exception:
+            self.stats['misses'] += 1
+            return None
+        self.stats['hits'] += 1
+        return metadata
+
+    def set(self, key, metadata):
+        try:
+            os.makedirs(self.path, mode=0o700, exist_ok=True)
+            _write_atomic(os.path.join(self.path, key + '.scale'), bytes(metadata.data.data))
+        except Exception:
+            # the cache is an optimization, the module works without it
+            pass
+
+
+def get_substrate(module):
+    """
+    Connect to module.params['url'], fail if the node is syncing.
+    The runtime metadata is cached in module.params['metadata_cache_dir'] if it is set.
+    """
+    try:
+        substrate = SubstrateInterface(
+            url=module.params['url'],
+        )
+    except ConnectionRefusedError as e:
+        module.fail_json(msg="Unable to connect to Substrate node url: %s, Error: %s " % (module.params['url'], e))
+
+    system_health = substrate.rpc_request(method="system_health", params=[])
+    if system_health["result"]["isSyncing"]:
+        module.fail_json(msg="Node '%s', is syncing" % (module.params['url'],))
+
+    if module.params.get('metadata_cache_dir'):
+        genesis_hash = substrate.get_block_hash(0)
+        substrate.cache_region = MetadataFileCache(module.params['metadata_cache_dir'], genesis_hash, substrate)
+
+    return substrate
+
+
+def warm_metadata_cache(module, substrate):
+    """Load the metadata of the current runtime into the cache and exit the module."""
+    if not isinstance(substrate.cache_region, MetadataFileCache):
+        module.fail_json(msg="metadata_cache_warm requires metadata_cache_dir")
+    try:
+        substrate.init_runtime()
+    except Exception as e:
+        module.fail_json(msg="Failed to load the runtime metadata: %s" % e, exception=traceback.format_exc())
+    stats = substrate.cache_region.stats
+    module.exit_json(
+        changed=stats['misses'] > 0,
+        metadata_cache=dict(stats, spec_version=substrate.runtime_version),
+    )
+
+
+def query_paras(substrate, para_ids, storage_functions, block_hash=None):
+    """
+    Query storage functions of the Paras pallet for many para ids at one block.
+    Keys are fetched with state_queryStorageAt in batches of QUERY_BATCH_SIZE, so the number of requests doesn't
+    grow with every para id. The chain head is used if block_hash is not set.
+    Returns the block hash and {para_id: {storage_function: value}}.
+    """
+    substrate.init_runtime(block_hash=block_hash)
+    block_hash = substrate.block_hash
+
+    result = dict((para_id, dict((name, None) for name in storage_functions)) for para_id in para_ids)
+    storage_keys = []
+    key_names = {}
+    for para_id in para_ids:
+        for name in storage_functions:
+            storage_key = StorageKey.create_from_storage_function(
+                'Paras', name, [para_id], runtime_config=substrate.runtime_config, metadata=substrate.metadata
+            )
+            storage_keys.append(storage_key)
+            key_names[storage_key.to_hex()] = (para_id, name)
+
+    for i in range(0, len(storage_keys), QUERY_BATCH_SIZE):
+        for storage_key, value in substrate.query_multi(storage_keys[i:i + QUERY_BATCH_SIZE], block_hash=block_hash):
+            para_id, name = key_names[storage_key.to_hex()]
+            result[para_id][name] = value.value
+    return block_hash, result
+
+
+def query_para_ids(substrate, block_hash):
+    """Return ids and lifecycles of all paras at the block by iterating Paras.ParaLifecycles."""
+    paras = substrate.query_map('Paras', 'ParaLifecycles', block_hash=block_hash, page_size=QUERY_MAP_PAGE_SIZE)
+    return dict((para_id.value, lifecycle.value) for para_id, lifecycle in paras)
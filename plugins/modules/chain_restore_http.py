@@ -0,0 +1,463 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, Devops Parity <devops@parity.io>
+# GPL-2.0-or-later
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: chain_restore_http
+short_description: Download a directory-style backup of a chain database over HTTP.
+version_added: "1.10.13"
+description:
+  - The list of files is read from the 'manifest.json' of the backup (incremental backups of the node_backup role)
+    or from 'files.txt' if the backup doesn't have a manifest.
+  - Files are downloaded concurrently, every worker keeps a persistent connection to the server.
+  - A file is downloaded to '<file>.partial' and renamed when it's complete. If the download is interrupted,
+    the next run resumes it from the size of the partial file.
+  - Files which are already present are skipped. If the manifest is used, their size
+    (and the sha256 hash if I(verify_existing=hash)) have to match the manifest.
+    'files.txt' doesn't have sizes, the size of files and partial files left by a previous run is checked
+    with a HEAD request. They are downloaded again if the server doesn't return the size.
+  - The list of files is fetched with the same retries as the files.
+options:
+    url:
+        description: URL of the backup directory, e.g. 'https://snapshots.polkadot.io/polkadot-rocksdb-prune/20230101-000000'.
+        required: true
+        type: str
+    dest:
+        description: Directory the backup is downloaded to. It's created if it doesn't exist.
+        required: true
+        type: path
+    jobs:
+        description: Number of parallel downloads.
+        required: false
+        type: int
+        default: 16
+    retries:
+        description: Number of retries of one file or of the list of files.
+        required: false
+        type: int
+        default: 6
+    timeout:
+        description: Timeout of HTTP requests in seconds.
+        required: false
+        type: int
+        default: 60
+    verify_existing:
+        description: How files which are already present are checked against the manifest.
+        required: false
+        type: str
+        choices: ['size', 'hash']
+        default: 'size'
+    validate_certs:
+        description: Validate SSL certificates.
+        required: false
+        type: bool
+        default: true
+    owner:
+        description: Owner of the downloaded files.
+        required: false
+        type: str
+    group:
+        description: Group of the downloaded files.
+        required: false
+        type: str
+
+author:
+    - Devops Parity (@paritytech)
+'''
+
+EXAMPLES = r'''
+- name: Restore the database
+  paritytech.chain.chain_restore_http:
+    url: https://snapshots.polkadot.io/polkadot-rocksdb-prune/20230101-000000
+    dest: /opt/polkadot/chains/polkadot/db
+    jobs: 32
+    owner: polkadot
+    group: polkadot
+'''
+
+RETURN = r'''
+source:
+    description: Source of the file list, 'manifest.json' or 'files.txt'.
+    type: str
+    returned: always
+    sample: 'manifest.json'
+files:
+    description: Number of files in the backup.
+    type: int
+    returned: always
+    sample: 1024
+downloaded_files:
+    description: Number of downloaded files.
+    type: int
+    returned: always
+    sample: 1000
+resumed_files:
+    description: Number of files which downloading was resumed from a partial file.
+    type: int
+    returned: always
+    sample: 1
+skipped_files:
+    description: Number of files which were already present.
+    type: int
+    returned: always
+    sample: 24
+downloaded_bytes:
+    description: Number of downloaded bytes.
+    type: int
+    returned: always
+    sample: 1073741824
+retries:
+    description: Number of retried downloads.
+    type: int
+    returned: always
+    sample: 0
+duration:
+    description: Duration of the restore in seconds.
+    type: float
+    returned: success
+    sample: 3600.5
+throughput:
+    description: Download throughput in bytes per second.
+    type: float
+    returned: success
+    sample: 104857600.0
+failed_files:
+    description: Files which weren't downloaded and the errors.
+    type: dict
+    returned: failure
+    sample: {'000123.sst': 'HTTP 404'}
+'''
+
+import os
+import grp
+import pwd
+import ssl
+import json
+import time
+import hashlib
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urljoin, urlsplit, quote
+from ansible.module_utils.basic import AnsibleModule
+
+READ_SIZE = 1024 * 1024
+MAX_REDIRECTS = 5
+MANIFEST_FILE = 'manifest.json'
+FILES_LIST_FILE = 'files.txt'
+
+
+class DownloadError(Exception):
+    """
+    Error which doesn't make sense to retry
+    """
+
+
+class ConnectionPool:
+    """
+    Keeps one persistent connection per thread and host
+    """
+
+    def __init__(self, timeout, validate_certs):
+        self.timeout = timeout
+        self.context = ssl.create_default_context() if validate_certs else ssl._create_unverified_context()
+        self.local = threading.local()
+
+    def _connections(self):
+        if not hasattr(self.local, 'connections'):
+            self.local.connections = {}
+        return self.local.connections
+
+    def _connection(self, scheme, netloc):
+        connections = self._connections()
+        if (scheme, netloc) not in connections:
+            if scheme == 'https':
+                connections[(scheme, netloc)] = HTTPSConnection(netloc, timeout=self.timeout, context=self.context)
+            elif scheme == 'http':
+                connections[(scheme, netloc)] = HTTPConnection(netloc, timeout=self.timeout)
+            else:
+                raise DownloadError("unsupported URL scheme: '%s'" % scheme)
+        return connections[(scheme, netloc)]
+
+    def reset(self):
+        """
+        Close connections of the current thread, e.g. after an interrupted response
+        """
+        for connection in self._connections().values():
+            connection.close()
+        self._connections().clear()
+
+    def request(self, method, url, headers=None):
+        for i in range(MAX_REDIRECTS + 1):
+            parts = urlsplit(url)
+            connection = self._connection(parts.scheme, parts.netloc)
+            try:
+                connection.request(method, parts.path + ('?' + parts.query if parts.query else ''), headers=headers or {})
+                response = connection.getresponse()
+            except (OSError, HTTPException):
+                self.reset()
+                raise
+            if response.status in (301, 302, 303, 307, 308):
+                response.read()
+                url = urljoin(url, response.getheader('Location'))
+                continue
+            return response
+        raise DownloadError("too many redirects for '%s'" % url)
+
+    def get(self, url, headers=None):
+        response = self.request('GET', url, headers)
+        if response.status >= 400 and response.status != 416:
+            response.read()
+            error = "HTTP %d for '%s'" % (response.status, url)
+            # server errors can be temporary
+            raise IOError(error) if response.status >= 500 else DownloadError(error)
+        return response
+
+    def get_size(self, url):
+        """
+        Return the size of the file from a HEAD request or None if the server doesn't return it
+        """
+        response = self.request('HEAD', url)
+        response.read()
+        if response.status >= 500:
+            raise IOError("HTTP %d for '%s'" % (response.status, url))
+        length = response.getheader('Content-Length', '')
+        return int(length) if response.status == 200 and length.isdigit() else None
+
+    def get_bytes(self, url):
+        return self.get(url).read()
+
+
+def get_ownership(module):
+    uid = gid = -1
+    try:
+        if module.params['owner']:
+            uid = pwd.getpwnam(module.params['owner']).pw_uid
+        if module.params['group']:
+            gid = grp.getgrnam(module.params['group']).gr_gid
+    except KeyError as e:
+        module.fail_json(msg="Unknown owner or group: %s" % e)
+    return uid, gid
+
+
+def get_file_list(pool, url):
+    """
+    Return the source of the list and the files: [{path, url, size, hash}]. size and hash are None for files.txt
+    """
+    base = url.rstrip('/') + '/'
+    try:
+        manifest = json.loads(pool.get_bytes(base + MANIFEST_FILE))
+    except DownloadError:
+        manifest = None
+    if manifest is not None:
+        # objects are stored next to the backup directories, e.g. '<prefix>/objects/ab/ab12...'
+        return MANIFEST_FILE, [{'path': i['path'], 'url': urljoin(base, '../' + quote(i['object'])),
+                                'size': i['size'], 'hash': i['hash']} for i in manifest['files']]
+    files = pool.get_bytes(base + FILES_LIST_FILE).decode().splitlines()
+    return FILES_LIST_FILE, [{'path': i.strip(), 'url': base + quote(i.strip()), 'size': None, 'hash': None}
+                             for i in files if i.strip()]
+
+
+def check_path(dest, path):
+    full_path = os.path.realpath(os.path.join(dest, path))
+    if os.path.isabs(path) or not full_path.startswith(dest + os.sep):
+        raise DownloadError("'%s' is outside of the destination" % path)
+    return full_path
+
+
+def hash_file(path):
+    file_hash = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(READ_SIZE), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def is_present(path, entry, verify_existing):
+    # the size of files from files.txt is unknown if the server doesn't return it, they can't be trusted
+    if entry['size'] is None or not os.path.isfile(path):
+        return False
+    if os.path.getsize(path) != entry['size']:
+        return False
+    return verify_existing != 'hash' or hash_file(path) == entry['hash']
+
+
+class Restore:
+    def __init__(self, module, pool, dest):
+        self.module = module
+        self.pool = pool
+        self.dest = dest
+        self.uid, self.gid = get_ownership(module)
+        self.lock = threading.Lock()
+        self.stats = dict(downloaded_files=0, resumed_files=0, skipped_files=0, downloaded_bytes=0, retries=0)
+
+    def count(self, **kwargs):
+        with self.lock:
+            for k, v in kwargs.items():
+                self.stats[k] += v
+
+    def retry(self, func, *args):
+        """
+        Call the function, temporary errors are retried with a growing delay
+        """
+        attempt = 0
+        while True:
+            try:
+                return func(*args)
+            except (OSError, HTTPException):
+                self.pool.reset()
+                attempt += 1
+                if attempt > self.module.params['retries']:
+                    raise
+                self.count(retries=1)
+                time.sleep(min(2 ** attempt, 60))
+
+    def resolve_size(self, entry, path):
+        """
+        Return the entry with the size from the server if it's from files.txt and a previous run left the file
+        or the partial file
+        """
+        if entry['size'] is not None or not (os.path.exists(path) or os.path.exists(path + '.partial')):
+            return entry
+        return dict(entry, size=self.retry(self.pool.get_size, entry['url']))
+
+    def is_missing(self, entry):
+        path = check_path(self.dest, entry['path'])
+        return not is_present(path, self.resolve_size(entry, path), self.module.params['verify_existing'])
+
+    def download(self, entry):
+        path = check_path(self.dest, entry['path'])
+        partial = path + '.partial'
+        entry = self.resolve_size(entry, path)
+        if is_present(path, entry, self.module.params['verify_existing']):
+            self.count(skipped_files=1)
+            return
+        if entry['size'] is None and os.path.exists(partial):
+            # the partial file can't be checked, it's downloaded again
+            os.unlink(partial)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        resumed = self.retry(self._fetch, entry, partial)
+        if self.uid != -1 or self.gid != -1:
+            os.chown(partial, self.uid, self.gid)
+        os.replace(partial, path)
+        self.count(downloaded_files=1, resumed_files=int(resumed))
+
+    def _fetch(self, entry, partial):
+        """
+        Download the file to the partial file, resuming it if it exists. Return True if it was resumed
+        """
+        offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        if entry['size'] is not None and offset > entry['size']:
+            offset = 0
+        file_hash = hashlib.sha256()
+        if offset and entry['hash']:
+            with open(partial, 'rb') as f:
+                for chunk in iter(lambda: f.read(READ_SIZE), b''):
+                    file_hash.update(chunk)
+        response = self.pool.get(entry['url'], {'Range': 'bytes=%d-' % offset} if offset else None)
+        if response.status == 416:
+            # the partial file is already complete, its size is checked below
+            response.read()
+        elif response.status != 206:
+            # the server ignored the range
+            offset = 0
+            file_hash = hashlib.sha256()
+        with open(partial, 'r+b' if offset else 'wb') as f:
+            f.seek(offset)
+            f.truncate()
+            while response.status != 416:
+                data = response.read(READ_SIZE)
+                if not data:
+                    break
+                f.write(data)
+                file_hash.update(data)
+                self.count(downloaded_bytes=len(data))
+            size = f.tell()
+        # the response is shorter than Content-Length, the connection can't be reused
+        if response.status != 416 and response.length:
+            raise IOError("the download of '%s' was interrupted" % entry['path'])
+        if entry['size'] is not None and size != entry['size']:
+            raise IOError("'%s' has %d bytes, expected %d" % (entry['path'], size, entry['size']))
+        if entry['hash'] and file_hash.hexdigest() != entry['hash']:
+            os.unlink(partial)
+            raise IOError("sha256 hash of '%s' doesn't match the manifest" % entry['path'])
+        return offset > 0
+
+
+def run_module():
+    module_args = dict(
+        url=dict(type='str', required=True),
+        dest=dict(type='path', required=True),
+        jobs=dict(type='int', default=16),
+        retries=dict(type='int', default=6),
+        timeout=dict(type='int', default=60),
+        verify_existing=dict(choices=['size', 'hash'], default='size'),
+        validate_certs=dict(type='bool', default=True),
+        owner=dict(type='str'),
+        group=dict(type='str'),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = dict(
+        changed=False
+    )
+
+    dest = os.path.realpath(module.params['dest'])
+    if os.path.exists(dest) and not os.path.isdir(dest):
+        module.fail_json(msg="Destination '%s' is not a directory" % dest)
+
+    pool = ConnectionPool(module.params['timeout'], module.params['validate_certs'])
+    restore = Restore(module, pool, dest)
+    try:
+        result['source'], files = restore.retry(get_file_list, pool, module.params['url'])
+    except Exception as e:
+        module.fail_json(msg="Unable to get the list of files of '%s', Error: %s" % (module.params['url'], e),
+                         exception=traceback.format_exc(), **restore.stats)
+    result['files'] = len(files)
+
+    if module.check_mode:
+        try:
+            with ThreadPoolExecutor(max_workers=max(module.params['jobs'], 1)) as executor:
+                missing = sum(executor.map(restore.is_missing, files))
+        except (DownloadError, OSError, HTTPException) as e:
+            module.fail_json(msg=str(e), **result)
+        result.update(restore.stats, skipped_files=len(files) - missing, changed=missing > 0)
+        module.exit_json(**result)
+
+    start = time.monotonic()
+    os.makedirs(dest, exist_ok=True)
+    failed = {}
+    with ThreadPoolExecutor(max_workers=max(module.params['jobs'], 1)) as executor:
+        futures = {executor.submit(restore.download, i): i['path'] for i in files}
+        for future, path in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                failed[path] = str(e)
+
+    result.update(restore.stats)
+    result['changed'] = restore.stats['downloaded_files'] > 0
+    result['duration'] = time.monotonic() - start
+    result['throughput'] = restore.stats['downloaded_bytes'] / result['duration'] if result['duration'] else 0.0
+    if failed:
+        module.fail_json(msg="%d of %d files weren't downloaded, the next run resumes the restore"
+                             % (len(failed), len(files)), failed_files=failed, **result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
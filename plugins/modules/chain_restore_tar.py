@@ -0,0 +1,438 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, Devops Parity <devops@parity.io>
+# GPL-2.0-or-later
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: chain_restore_tar
+short_description: Download a tar backup of a chain database and extract it on the fly.
+version_added: "1.10.13"
+description:
+  - The archive is downloaded by parallel HTTP range requests into a bounded in-memory buffer
+    and extracted while it's being downloaded, so the archive is never stored on the disk.
+  - An interrupted range request is resumed from the last received byte.
+  - The checksum of the archive is calculated while the stream goes by and is checked at the end.
+    If the checksum doesn't match or the download fails, the extracted files are removed.
+  - If the server doesn't support range requests, the archive is downloaded by one request without resuming.
+  - Compressed archives (gzip, bzip2, xz) are supported.
+options:
+    url:
+        description: URL of the tar archive.
+        required: true
+        type: str
+    dest:
+        description: Directory the archive is extracted to. It's created if it doesn't exist.
+        required: true
+        type: path
+    checksum:
+        description:
+          - Checksum of the archive in the format '<algorithm>:<checksum>', e.g. 'sha256:9f86d0...'.
+          - If it's not set, the MD5 hash from the 'x-goog-hash' header is checked if the server sends it.
+        required: false
+        type: str
+    jobs:
+        description: Number of parallel range requests.
+        required: false
+        type: int
+        default: 8
+    chunk_size:
+        description: Size of one range request in MiB.
+        required: false
+        type: int
+        default: 16
+    buffer_chunks:
+        description:
+          - Maximum number of downloaded chunks which wait for extraction.
+          - It limits the memory usage to about 'buffer_chunks * chunk_size'. The default is '2 * jobs'.
+        required: false
+        type: int
+    retries:
+        description: Number of retries of one range request.
+        required: false
+        type: int
+        default: 10
+    timeout:
+        description: Timeout of HTTP requests in seconds.
+        required: false
+        type: int
+        default: 900
+    validate_certs:
+        description: Validate SSL certificates.
+        required: false
+        type: bool
+        default: true
+    owner:
+        description: Owner of the extracted files.
+        required: false
+        type: str
+    group:
+        description: Group of the extracted files.
+        required: false
+        type: str
+
+author:
+    - Devops Parity (@paritytech)
+'''
+
+EXAMPLES = r'''
+- name: Restore the database
+  paritytech.chain.chain_restore_tar:
+    url: https://example.com/polkadot-rocksdb-prune/20230101-000000/db.tar
+    dest: /opt/polkadot/chains/polkadot/db
+    checksum: "sha256:9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08"
+    owner: polkadot
+    group: polkadot
+'''
+
+RETURN = r'''
+size:
+    description: Size of the downloaded archive in bytes.
+    type: int
+    returned: always
+    sample: 1073741824
+files:
+    description: Number of the extracted tar members.
+    type: int
+    returned: success
+    sample: 1024
+checksums:
+    description: Algorithms of the checked checksums.
+    type: list
+    returned: success
+    sample: ['sha256']
+ranged:
+    description: Whether the archive was downloaded by range requests.
+    type: bool
+    returned: always
+    sample: true
+retries:
+    description: Number of retried range requests.
+    type: int
+    returned: success
+    sample: 0
+duration:
+    description: Duration of the restore in seconds.
+    type: float
+    returned: success
+    sample: 3600.5
+'''
+
+import os
+import re
+import grp
+import pwd
+import time
+import base64
+import shutil
+import hashlib
+import tarfile
+import threading
+import traceback
+from http.client import HTTPException
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.urls import open_url
+
+MIB = 1024 * 1024
+READ_SIZE = MIB
+
+
+class ChecksumReader:
+    """
+    File-like object which calculates hashes of the data read through it
+    """
+
+    def __init__(self, fileobj, hashes):
+        self.fileobj = fileobj
+        self.hashes = hashes
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        for h in self.hashes.values():
+            h.update(data)
+        self.size += len(data)
+        return data
+
+
+class RangeReader:
+    """
+    File-like object which reads an HTTP resource sequentially while it's downloaded by parallel range requests.
+    Downloaded chunks wait for the reader in a buffer of 'buffer_chunks' chunks.
+    """
+
+    def __init__(self, module, url, size, chunk_size, jobs, buffer_chunks, retries):
+        self.module = module
+        self.url = url
+        self.size = size
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.count = (size + chunk_size - 1) // chunk_size
+        self.condition = threading.Condition()
+        # a worker takes a slot before it takes the next chunk index, so the lowest chunk the reader needs
+        # is always being downloaded
+        self.slots = threading.Semaphore(buffer_chunks)
+        self.chunks = {}
+        self.next_index = 0
+        self.error = None
+        self.retried = 0
+        self.current = b''
+        self.current_index = 0
+        self.offset = 0
+        self.threads = [threading.Thread(target=self._run, daemon=True) for i in range(min(jobs, self.count))]
+        for thread in self.threads:
+            thread.start()
+
+    def _run(self):
+        while True:
+            self.slots.acquire()
+            with self.condition:
+                if self.error is not None or self.next_index >= self.count:
+                    self.slots.release()
+                    return
+                index = self.next_index
+                self.next_index += 1
+            try:
+                data = self._fetch(index)
+            except Exception as e:
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.chunks[index] = data
+                self.condition.notify_all()
+
+    def _fetch(self, index):
+        start = index * self.chunk_size
+        length = min(self.chunk_size, self.size - start)
+        parts = []
+        received = 0
+        attempt = 0
+        while True:
+            try:
+                response = open_request(self.module, self.url, 'bytes=%d-%d' % (start + received, start + length - 1))
+                if response.getcode() != 206:
+                    raise ValueError("the server stopped supporting range requests, HTTP code: %s" % response.getcode())
+                while received < length:
+                    data = response.read(min(READ_SIZE, length - received))
+                    if not data:
+                        raise IOError("the connection was closed after %d bytes of the range" % received)
+                    parts.append(data)
+                    received += len(data)
+                return b''.join(parts)
+            except (OSError, HTTPException):
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                with self.condition:
+                    self.retried += 1
+                time.sleep(min(2 ** attempt, 60))
+
+    def read(self, size=-1):
+        result = []
+        while size != 0:
+            if self.offset >= len(self.current):
+                if self.current_index >= self.count:
+                    break
+                with self.condition:
+                    while self.current_index not in self.chunks and self.error is None:
+                        self.condition.wait()
+                    if self.current_index not in self.chunks:
+                        raise self.error
+                    self.current = self.chunks.pop(self.current_index)
+                self.slots.release()
+                self.current_index += 1
+                self.offset = 0
+            available = len(self.current) - self.offset
+            length = available if size < 0 else min(size, available)
+            result.append(self.current[self.offset:self.offset + length])
+            self.offset += length
+            if size > 0:
+                size -= length
+        return b''.join(result)
+
+    def close(self):
+        with self.condition:
+            if self.error is None:
+                self.error = IOError("the download was cancelled")
+            self.chunks.clear()
+        # wake up the workers which wait for a free slot
+        for thread in self.threads:
+            self.slots.release()
+
+
+def open_request(module, url, byte_range=None):
+    headers = {'Range': byte_range} if byte_range else {}
+    return open_url(url, headers=headers, timeout=module.params['timeout'],
+                    validate_certs=module.params['validate_certs'], follow_redirects='all')
+
+
+def parse_checksum(module):
+    hashes = {}
+    expected = {}
+    if module.params['checksum']:
+        try:
+            algorithm, value = module.params['checksum'].split(':', 1)
+        except ValueError:
+            module.fail_json(msg="checksum has to be in the format '<algorithm>:<checksum>'")
+        if algorithm not in hashlib.algorithms_available:
+            module.fail_json(msg="checksum algorithm '%s' is not supported" % algorithm)
+        hashes[algorithm] = hashlib.new(algorithm)
+        expected[algorithm] = value.strip().lower()
+    return hashes, expected
+
+
+def google_md5(response):
+    # e.g. 'x-goog-hash: crc32c=n03x6A==, md5=Ojk9c3dhfxgoKVVHYwFbHQ=='
+    match = re.search(r'md5=([A-Za-z0-9+/=]+)', response.headers.get('x-goog-hash') or '')
+    return base64.b64decode(match.group(1)).hex() if match else None
+
+
+def check_member(member, dest):
+    def inside(path):
+        path = os.path.realpath(os.path.join(dest, path))
+        return path == dest or path.startswith(dest + os.sep)
+
+    if os.path.isabs(member.name) or not inside(member.name):
+        raise ValueError("tar member '%s' is outside of the destination" % member.name)
+    if member.issym() and not inside(os.path.join(os.path.dirname(member.name), member.linkname)):
+        raise ValueError("symlink '%s' points outside of the destination" % member.name)
+    if member.islnk() and not inside(member.linkname):
+        raise ValueError("hard link '%s' points outside of the destination" % member.name)
+    if member.isdev():
+        raise ValueError("tar member '%s' is a device file" % member.name)
+
+
+def get_ownership(module):
+    uid = gid = -1
+    try:
+        if module.params['owner']:
+            uid = pwd.getpwnam(module.params['owner']).pw_uid
+        if module.params['group']:
+            gid = grp.getgrnam(module.params['group']).gr_gid
+    except KeyError as e:
+        module.fail_json(msg="Unknown owner or group: %s" % e)
+    return uid, gid
+
+
+def extract(module, reader, dest, created):
+    uid, gid = get_ownership(module)
+    extract_args = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+    files = 0
+    with tarfile.open(fileobj=reader, mode='r|*', bufsize=READ_SIZE) as tar:
+        for member in tar:
+            check_member(member, dest)
+            top = os.path.normpath(member.name).split(os.sep, 1)[0]
+            if top != '.' and top not in created and not os.path.lexists(os.path.join(dest, top)):
+                created.add(top)
+            tar.extract(member, dest, **extract_args)
+            if uid != -1 or gid != -1:
+                os.lchown(os.path.join(dest, member.name), uid, gid)
+            files += 1
+    return files
+
+
+def cleanup(dest, created):
+    for name in created:
+        path = os.path.join(dest, name)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path, ignore_errors=True)
+        elif os.path.lexists(path):
+            os.unlink(path)
+
+
+def run_module():
+    module_args = dict(
+        url=dict(type='str', required=True),
+        dest=dict(type='path', required=True),
+        checksum=dict(type='str'),
+        jobs=dict(type='int', default=8),
+        chunk_size=dict(type='int', default=16),
+        buffer_chunks=dict(type='int'),
+        retries=dict(type='int', default=10),
+        timeout=dict(type='int', default=900),
+        validate_certs=dict(type='bool', default=True),
+        owner=dict(type='str'),
+        group=dict(type='str'),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = dict(
+        changed=False
+    )
+
+    dest = os.path.realpath(module.params['dest'])
+    if os.path.exists(dest) and not os.path.isdir(dest):
+        module.fail_json(msg="Destination '%s' is not a directory" % dest)
+    hashes, expected = parse_checksum(module)
+
+    start = time.monotonic()
+    # the first byte request shows whether the server supports ranges and returns the size of the archive
+    try:
+        response = open_request(module, module.params['url'], 'bytes=0-0')
+    except Exception as e:
+        module.fail_json(msg="Unable to download '%s', Error: %s" % (module.params['url'], e))
+    content_range = re.match(r'bytes 0-0/(\d+)$', response.headers.get('Content-Range') or '')
+    result['ranged'] = response.getcode() == 206 and content_range is not None
+    if result['ranged']:
+        result['size'] = int(content_range.group(1))
+        response.close()
+    else:
+        result['size'] = int(response.headers.get('Content-Length') or 0)
+
+    if 'md5' not in hashes:
+        md5 = google_md5(response)
+        if md5:
+            hashes['md5'] = hashlib.md5()
+            expected['md5'] = md5
+
+    result['changed'] = True
+    if module.check_mode:
+        module.exit_json(**result)
+
+    os.makedirs(dest, exist_ok=True)
+    if result['ranged']:
+        jobs = max(module.params['jobs'], 1)
+        source = RangeReader(module, module.params['url'], result['size'], module.params['chunk_size'] * MIB, jobs,
+                             module.params['buffer_chunks'] or 2 * jobs, module.params['retries'])
+    else:
+        source = response
+    reader = ChecksumReader(source, hashes)
+    created = set()
+    try:
+        result['files'] = extract(module, reader, dest, created)
+        # the end of the archive can have padding which tar doesn't read
+        while reader.read(READ_SIZE):
+            pass
+        result['size'] = reader.size
+        for algorithm, value in expected.items():
+            actual = hashes[algorithm].hexdigest()
+            if actual != value:
+                raise ValueError("%s checksum of the archive is %s, expected %s" % (algorithm, actual, value))
+    except Exception as e:
+        source.close()
+        cleanup(dest, created)
+        module.fail_json(msg="Unable to restore '%s', Error: %s" % (module.params['url'], e),
+                         exception=traceback.format_exc(), **result)
+    source.close()
+
+    result['checksums'] = sorted(expected)
+    result['retries'] = source.retried if result['ranged'] else 0
+    result['duration'] = time.monotonic() - start
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+
+# Copyright: (c) 2022, Devops Parity <devops@parity.io>
+# GPL-2.0-or-later
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+DOCUMENTATION = r'''
+---
+module: parachain_info
+short_description: Get the state of parachains registered on a relay chain.
+version_added: "1.10.13"
+description:
+  - Returns lifecycles, current code hashes and head data of parachains from the Paras pallet.
+  - All values are read at one block, storage keys of many paras are fetched with batched
+    C(state_queryStorageAt) requests, so an audit of all paras costs a few RPC calls.
+  - This module is wrapper for substrate-interface python library.
+requirements:
+  - substrate-interface
+options:
+    url:
+        description: WS rpc endpoint.
+        required: false
+        type: str
+        default: 'ws://127.0.0.1:9944'
+    ids:
+        description:
+          - Para Ids to query.
+          - If not set, all paras are found by iterating C(Paras.ParaLifecycles).
+        required: false
+        type: list
+        elements: int
+    block_hash:
+        description: Hash of the block to read the state at, the finalized head is used by default.
+        required: false
+        type: str
+    heads:
+        description: Whether to return the head data of paras.
+        required: false
+        type: bool
+        default: true
+extends_documentation_fragment:
+    - paritytech.chain.substrate
+author:
+    - Devops Parity (@paritytech)
+'''
+
+EXAMPLES = r'''
+# Get the state of all paras
+- name: Audit parachains
+  paritytech.chain.parachain_info:
+    url: 'ws://127.0.0.1:9944'
+  register: parachains
+
+# Get the state of some paras at a block
+- name: Get parachains
+  paritytech.chain.parachain_info:
+    url: 'ws://127.0.0.1:9944'
+    ids: [1000, 2000]
+    block_hash: '0xc3c238e11de1e0e74ca076b002934d437a4c5a044cdc91cf7835c09f82a941d6'
+    heads: false
+'''
+
+RETURN = r'''
+block_hash:
+    description: Hash of the block the state is read at
+    returned: always
+    type: str
+    sample: '0xc3c238e11de1e0e74ca076b002934d437a4c5a044cdc91cf7835c09f82a941d6'
+block_number:
+    description: Number of the block the state is read at
+    returned: always
+    type: int
+    sample: 1024
+parachains:
+    description: State of paras ordered by id, paras which aren't registered have null values
+    returned: always
+    type: list
+    elements: dict
+    contains:
+        id:
+            description: Para Id
+            type: int
+            returned: always
+            sample: 1000
+        paraLifecycles:
+            description: Current state of parachain
+            type: str
+            returned: always
+            sample: "Parachain"
+        currentCodeHash:
+            description: Current wasm hash in network for ParaId
+            type: str
+            returned: always
+            sample: "0x0b004419ddaed13fd1f08044685597485b1054e61ea2d293346205fea0d6d500"
+        head:
+            description: Head data of the para
+            type: str
+            returned: when heads is true
+            sample: "0x0000...00"
+'''
+
+import traceback
+from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.paritytech.chain.plugins.module_utils.substrate import (
+    SUBSTRATE_ARGUMENT_SPEC,
+    get_substrate,
+    query_para_ids,
+    query_paras,
+    warm_metadata_cache,
+)
+
+try:
+    from substrateinterface.exceptions import SubstrateRequestException
+
+    python_substrateinterface_installed = True
+except ImportError:
+    python_substrateinterface_installed = False
+
+
+def test_dependencies(module):
+    if not python_substrateinterface_installed:
+        module.fail_json(msg="substrate-interface required for this module")
+
+
+def get_parachains(module, substrate, block_hash):
+    storage_functions = ['CurrentCodeHash']
+    if module.params['heads']:
+        storage_functions.append('Heads')
+
+    if module.params['ids'] is None:
+        lifecycles = query_para_ids(substrate, block_hash)
+        para_ids = sorted(lifecycles)
+    else:
+        lifecycles = None
+        para_ids = sorted(set(module.params['ids']))
+        storage_functions.append('ParaLifecycles')
+
+    block_hash, paras = query_paras(substrate, para_ids, storage_functions, block_hash=block_hash)
+
+    parachains = []
+    for para_id in para_ids:
+        para = paras[para_id]
+        parachain = {
+            'id': para_id,
+            'paraLifecycles': lifecycles[para_id] if lifecycles is not None else para['ParaLifecycles'],
+            'currentCodeHash': para['CurrentCodeHash'],
+        }
+        if module.params['heads']:
+            parachain['head'] = para['Heads']
+        parachains.append(parachain)
+    return parachains
+
+
+def run_module():
+    module_args = dict(
+        url=dict(type='str', default='ws://127.0.0.1:9944'),
+        ids=dict(type='list', elements='int'),
+        block_hash=dict(type='str'),
+        heads=dict(type='bool', default=True),
+        **SUBSTRATE_ARGUMENT_SPEC
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = dict(
+        changed=False
+    )
+
+    test_dependencies(module)
+
+    substrate = get_substrate(module)
+
+    if module.params['metadata_cache_warm']:
+        warm_metadata_cache(module, substrate)
+
+    try:
+        block_hash = module.params['block_hash'] or substrate.get_chain_finalised_head()
+        result['parachains'] = get_parachains(module, substrate, block_hash)
+        result['block_hash'] = block_hash
+        result['block_number'] = substrate.get_block_number(block_hash)
+    except SubstrateRequestException as e:
+        module.fail_json(msg="Failed to query parachains: %s" % e, exception=traceback.format_exc(), **result)
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -17,14 +17,15 @@ description:
   - Only for testnets, requires SUDO.
 requirements:
   - substrate-interface
+  - zstandard, if I(validation_code_file) or I(genesis_head_file) is zstd-compressed
 options:
     url:
         description: WS rpc endpoint.
         required: true
         type: str
     key:
-        description: Key to  commit transaction. 
-        required: true
+        description: Key to  commit transaction. Not required if I(metadata_cache_warm) is set.
+        required: false
         type: str
     key_type: 
         description: Key type hex seed or uri
@@ -32,17 +33,89 @@ options:
         type: choices=['seed', 'uri']
         default: 'seed'
     id:
-        description: Para Id
-        required: true
+        description:
+          - Para Id, either I(id) or I(parachains) is required.
+          - Mutually exclusive with I(parachains).
+        required: false
         type: int
-    genesis_head: 
-        description: Head data for a Para Id
-        required: true
-        type: bool
+    parachains:
+        description:
+          - List of parachains which are registered or cleaned up in one extrinsic.
+          - Only the parachains whose state differs from the chain are included in one C(Utility.batch_all) call
+            under C(Sudo.sudo), so all changes are applied in one block or not at all.
+          - I(parachain) and I(state) of items default to the module options.
+          - Mutually exclusive with I(id). I(genesis_head), I(validation_code) and their files are set per item,
+            the module options are not used.
+        required: false
+        type: list
+        elements: dict
+        version_added: "1.10.13"
+        suboptions:
+            id:
+                description: Para Id
+                required: true
+                type: int
+            genesis_head:
+                description:
+                  - Head data for a Para Id.
+                  - Either I(genesis_head) or I(genesis_head_file) is required if the state is present,
+                    they are mutually exclusive.
+                required: false
+                type: str
+            validation_code:
+                description:
+                  - Validation code for a Para Id.
+                  - Either I(validation_code) or I(validation_code_file) is required if the state is present,
+                    they are mutually exclusive.
+                required: false
+                type: str
+            genesis_head_file:
+                description: Path to the head data on the target, see I(genesis_head_file).
+                required: false
+                type: path
+            validation_code_file:
+                description: Path to the validation code on the target, see I(validation_code_file).
+                required: false
+                type: path
+            parachain:
+                description: parachain
+                required: false
+                type: bool
+            state:
+                description: Whether to onboard (present), or cleanup (absent) a parachain.
+                required: false
+                type: choices=['present', 'absent']
+    genesis_head:
+        description:
+          - Head data for a Para Id.
+          - Either I(genesis_head) or I(genesis_head_file) is required if I(id) is set and I(state=present),
+            they are mutually exclusive.
+        required: false
+        type: str
     validation_code:
-        description: Validation code for a Para Id.
-        required: true
+        description:
+          - Validation code for a Para Id.
+          - Either I(validation_code) or I(validation_code_file) is required if I(id) is set and I(state=present),
+            they are mutually exclusive.
+        required: false
         type: str
+    genesis_head_file:
+        description:
+          - Path to the head data on the target, an alternative to I(genesis_head).
+          - The file can contain raw bytes or a 0x-prefixed hex string and can be zstd-compressed.
+        required: false
+        type: path
+        version_added: "1.10.13"
+    validation_code_file:
+        description:
+          - Path to the validation code (wasm) on the target, an alternative to I(validation_code).
+          - The file can contain raw bytes or a 0x-prefixed hex string and can be zstd-compressed.
+            Compressed runtimes built by Substrate (C(*.compact.compressed.wasm)) are sent as they are.
+          - The file is read once and the code hash is computed while it is read,
+            so a large runtime doesn't go through the module arguments.
+        required: false
+        type: path
+        version_added: "1.10.13"
     parachain:
         description: parachain
         required: false
@@ -54,6 +127,8 @@ options:
         type: choices=['present', 'absent']
         default: 'present'
         
+extends_documentation_fragment:
+    - paritytech.chain.substrate
 author:
     - Bulat Saifullin (@BulatSaif)
 '''
@@ -78,6 +153,38 @@ EXAMPLES = r'''
     genesis_head: "{{ lookup('file', 'path/to/genesis-state') }}"
     validation_code: "{{ lookup('file', 'path/to/genesis-wasm') }}"
 
+# read the genesis from files on the target
+- name: Register parachain
+  infrastructure.chain_operations.sudo_schedule_para_initialize:
+    url: 'ws://127.0.0.1:9944'
+    key: "0x56...92"
+    id: "1000"
+    genesis_head_file: /tmp/genesis-state
+    validation_code_file: /tmp/genesis-wasm.zst
+
+# Register several parachains and cleanup one in a single extrinsic
+- name: Register parachains
+  infrastructure.chain_operations.sudo_schedule_para_initialize:
+    url: 'ws://127.0.0.1:9944'
+    key: "//Alice"
+    key_type: uri
+    parachains:
+      - id: 1000
+        genesis_head: "{{ lookup('file', 'path/to/1000/genesis-state') }}"
+        validation_code: "{{ lookup('file', 'path/to/1000/genesis-wasm') }}"
+      - id: 2000
+        genesis_head: "{{ lookup('file', 'path/to/2000/genesis-state') }}"
+        validation_code: "{{ lookup('file', 'path/to/2000/genesis-wasm') }}"
+        parachain: false
+      - id: 3000
+        state: absent
+
+# Warm the metadata cache, e.g. in a pre-task
+- name: Warm metadata cache
+  infrastructure.chain_operations.sudo_schedule_para_initialize:
+    url: 'ws://127.0.0.1:9944'
+    metadata_cache_warm: true
+
 '''
 
 RETURN = r'''
@@ -162,61 +269,162 @@ parachain:
             type: str
             returned: always
             sample: "Parachain"
+parachains:
+    description: Per-para results if I(parachains) is used, in the order of the items
+    returned: when parachains is used
+    type: list
+    elements: dict
+    contains:
+        id:
+            description: Para Id
+            type: int
+            sample: 1000
+        state:
+            description: Requested state
+            type: str
+            sample: "present"
+        changed:
+            description: Whether the para was included in the batch
+            type: bool
+            sample: true
+        before:
+            description: C(paraLifecycles) and C(currentCodeHash) before the change
+            type: dict
+        after:
+            description: C(paraLifecycles) and C(currentCodeHash) after the change
+            type: dict
+        newCodeHash:
+            description: Hash of the validation code if the state is present
+            type: str
+        batch_index:
+            description: Index of the call in the batch, only for changed paras
+            type: int
+            sample: 0
+        triggered_events:
+            description: Events which were triggered for the para, e.g. C(Paras.PvfCheckStarted) or C(Utility.ItemCompleted)
+            type: list
+metadata_cache:
+    description: Cache statistics
+    returned: when metadata_cache_warm is set
+    type: dict
+    sample: {'path': '/root/.cache/paritytech.chain/metadata/0x91b1...90c3', 'hits': 0, 'misses': 1, 'spec_version': 1000000}
 '''
 
+import binascii
+import hashlib
 import traceback
 from ansible.module_utils.basic import AnsibleModule
+from ansible_collections.paritytech.chain.plugins.module_utils.substrate import (
+    SUBSTRATE_ARGUMENT_SPEC,
+    get_substrate,
+    query_paras,
+    warm_metadata_cache,
+)
 
 try:
-    from substrateinterface import SubstrateInterface, Keypair
+    from substrateinterface import Keypair
     from substrateinterface.exceptions import SubstrateRequestException
-    from substrateinterface.utils.hasher import blake2_256
 
     python_substrateinterface_installed = True
 except ImportError:
     python_substrateinterface_installed = False
 
+try:
+    import zstandard
+
+    python_zstandard_installed = True
+except ImportError:
+    python_zstandard_installed = False
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+READ_CHUNK_SIZE = 1024 * 1024
+
 
 def test_dependencies(module):
     if not python_substrateinterface_installed:
         module.fail_json(msg="substrate-interface required for this module. see TODO link to this file")
 
 
-def test_genesis(module):
+def read_genesis_file(module, path, name):
+    """
+    Read raw or hex encoded, optionally zstd-compressed, data from the file.
+    Returns the bytes and their blake2_256 hash, which is computed while the file is read.
+    """
+    hasher = hashlib.blake2b(digest_size=32)
+    parts = []
     try:
-        genesis_bytearray = bytearray.fromhex(module.params['genesis_head'].replace('0x', ''))
-    except ValueError as e:
-        module.fail_json(msg="genesis_head is not hex, Error: %s" % e, exception=traceback.format_exc())
+        with open(path, 'rb') as f:
+            stream = f
+            if f.read(len(ZSTD_MAGIC)) == ZSTD_MAGIC:
+                if not python_zstandard_installed:
+                    module.fail_json(msg="%s: %s is zstd-compressed, zstandard is required" % (name, path))
+                f.seek(0)
+                stream = zstandard.ZstdDecompressor().stream_reader(f)
+            else:
+                f.seek(0)
+
+            chunk = stream.read(READ_CHUNK_SIZE)
+            is_hex = chunk[:2] == b'0x'
+            if is_hex:
+                chunk = chunk[2:]
+            pending = b''
+            while chunk:
+                if is_hex:
+                    # whitespace and the trailing newline are ignored, an odd digit is kept for the next chunk
+                    chunk = pending + b''.join(chunk.split())
+                    cut = len(chunk) - len(chunk) % 2
+                    pending = chunk[cut:]
+                    chunk = binascii.unhexlify(chunk[:cut])
+                hasher.update(chunk)
+                parts.append(chunk)
+                chunk = stream.read(READ_CHUNK_SIZE)
+            if pending:
+                module.fail_json(msg="%s: %s has an odd number of hex digits" % (name, path))
+    except (IOError, OSError) as e:
+        module.fail_json(msg="%s: unable to read %s: %s" % (name, path, e), exception=traceback.format_exc())
+    except Exception as e:
+        module.fail_json(msg="%s: %s is not valid: %s" % (name, path, e), exception=traceback.format_exc())
+
+    return b''.join(parts), "0x" + hasher.hexdigest()
+
+
+def test_genesis(module, params=None):
+    """
+    Check genesis_head and validation_code, return the hash of the validation code.
+    The content of genesis_head_file and validation_code_file is loaded into params.
+    """
+    params = params or module.params
+    if params.get('genesis_head_file'):
+        params['genesis_head'] = read_genesis_file(module, params['genesis_head_file'], 'genesis_head_file')[0]
+    else:
+        try:
+            bytearray.fromhex(params['genesis_head'].replace('0x', ''))
+        except ValueError as e:
+            module.fail_json(msg="genesis_head is not hex, Error: %s" % e, exception=traceback.format_exc())
+
+    if params.get('validation_code_file'):
+        params['validation_code'], code_hash = read_genesis_file(
+            module, params['validation_code_file'], 'validation_code_file')
+        return code_hash
 
     try:
-        code_bytearray = bytearray.fromhex(module.params['validation_code'].replace('0x', ''))
+        code_bytearray = bytearray.fromhex(params['validation_code'].replace('0x', ''))
     except ValueError as e:
         module.fail_json(msg="validation_code is not hex, Error: %s" % e, exception=traceback.format_exc())
 
-    return "0x" + blake2_256(code_bytearray)
-
+    return "0x" + hashlib.blake2b(code_bytearray, digest_size=32).hexdigest()
 
-def check_parachain_exists(module, substrate):
-    para_id = module.params['id']
-    para_lifecycles = substrate.query('Paras', 'ParaLifecycles', params=[para_id])
-    para_current_code_hash = substrate.query('Paras', 'CurrentCodeHash', params=[para_id])
 
-    return {'paraLifecycles': para_lifecycles.value, 'currentCodeHash': para_current_code_hash.value}
-
-
-def get_substrate(module):
-    try:
-        substrate = SubstrateInterface(
-            url=module.params['url'],
-        )
-    except ConnectionRefusedError as e:
-        module.fail_json(msg="Unable to connect to Substrate node url: %s, Error: %s " % (module.params['url'], e))
+def check_parachains_exist(module, substrate, para_ids):
+    block_hash, paras = query_paras(substrate, para_ids, ('ParaLifecycles', 'CurrentCodeHash'))
+    return dict((para_id, {'paraLifecycles': para['ParaLifecycles'], 'currentCodeHash': para['CurrentCodeHash']})
+                for para_id, para in paras.items())
 
-    system_health = substrate.rpc_request(method="system_health", params=[])
-    if system_health["result"]["isSyncing"]:
-        module.fail_json(msg="Node '%s', is syncing" % (module.params['url'],))
 
-    return substrate
+def check_parachain_exists(module, substrate, para_id=None):
+    if para_id is None:
+        para_id = module.params['id']
+    return check_parachains_exist(module, substrate, [para_id])[para_id]
 
 
 def get_keypair(module):
@@ -235,49 +443,32 @@ def get_keypair(module):
     return keypair
 
 
-def add_parachain(module, substrate, keypair):
-    payload = substrate.compose_call(
+def compose_initialize(substrate, params):
+    return substrate.compose_call(
         call_module='ParasSudoWrapper',
         call_function='sudo_schedule_para_initialize',
         call_params={
-            'id': module.params['id'],
+            'id': params['id'],
             'genesis': {
-                'genesis_head': module.params['genesis_head'],
-                'validation_code': module.params['validation_code'],
-                'parachain': module.params['parachain']
+                'genesis_head': params['genesis_head'],
+                'validation_code': params['validation_code'],
+                'parachain': params['parachain']
             }
         }
     )
 
-    call = substrate.compose_call(
-        call_module='Sudo',
-        call_function='sudo',
-        call_params={
-            'call': payload.value,
-        }
-    )
-
-    extrinsic = substrate.create_signed_extrinsic(
-        call=call,
-        keypair=keypair,
-    )
-
-    try:
-        receipt = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True)
-        return receipt
-    except SubstrateRequestException as e:
-        module.fail_json(msg="Failed to send Request: %s" % e, exception=traceback.format_exc())
-
 
-def cleanup_parachain(module, substrate, keypair):
-    payload = substrate.compose_call(
+def compose_cleanup(substrate, params):
+    return substrate.compose_call(
         call_module='ParasSudoWrapper',
         call_function='sudo_schedule_para_cleanup',
         call_params={
-            'id': module.params['id']
+            'id': params['id']
         }
     )
 
+
+def submit_sudo(module, substrate, keypair, payload):
     call = substrate.compose_call(
         call_module='Sudo',
         call_function='sudo',
@@ -298,8 +489,27 @@ def cleanup_parachain(module, substrate, keypair):
         module.fail_json(msg="Failed to send Request: %s" % e, exception=traceback.format_exc())
 
 
-def parse_receipt_and_exit(module, substrate, result, receipt):
-    result['receipt'] = {
+def add_parachain(module, substrate, keypair, params=None):
+    return submit_sudo(module, substrate, keypair, compose_initialize(substrate, params or module.params))
+
+
+def cleanup_parachain(module, substrate, keypair):
+    return submit_sudo(module, substrate, keypair, compose_cleanup(substrate, module.params))
+
+
+def submit_batch(module, substrate, keypair, payloads):
+    batch = substrate.compose_call(
+        call_module='Utility',
+        call_function='batch_all',
+        call_params={
+            'calls': [payload.value for payload in payloads],
+        }
+    )
+    return submit_sudo(module, substrate, keypair, batch)
+
+
+def parse_receipt(receipt):
+    return {
         'block_hash': receipt.block_hash,
         'error_message': receipt.error_message,
         'extrinsic_hash': receipt.extrinsic_hash,
@@ -310,6 +520,10 @@ def parse_receipt_and_exit(module, substrate, result, receipt):
         'weight': receipt.weight,
         'triggered_events': [event.value for event in receipt.triggered_events]
     }
+
+
+def parse_receipt_and_exit(module, substrate, result, receipt):
+    result['receipt'] = parse_receipt(receipt)
     result['parachain'] = check_parachain_exists(module, substrate)
 
     if module._diff:
@@ -326,45 +540,182 @@ def parse_receipt_and_exit(module, substrate, result, receipt):
                 % (module.params['url'], result['receipt']['block_hash']), **result)
 
 
+def get_parachains(module):
+    parachains = []
+    for item in module.params['parachains']:
+        params = dict(item)
+        if params['parachain'] is None:
+            params['parachain'] = module.params['parachain']
+        if params['state'] is None:
+            params['state'] = module.params['state']
+        for name in ('genesis_head', 'validation_code'):
+            if params[name] and params[name + '_file']:
+                module.fail_json(msg="parachain %s: %s and %s_file are mutually exclusive" % (params['id'], name, name))
+            if params['state'] == 'present' and not (params[name] or params[name + '_file']):
+                module.fail_json(msg="parachain %s: %s or %s_file is required if state is present"
+                                     % (params['id'], name, name))
+        parachains.append(params)
+
+    ids = [params['id'] for params in parachains]
+    duplicates = sorted(set(i for i in ids if ids.count(i) > 1))
+    if duplicates:
+        module.fail_json(msg="parachains contains duplicated ids: %s" % duplicates)
+    return parachains
+
+
+def event_para_id(event, para_id):
+    attributes = event['attributes']
+    if isinstance(attributes, dict):
+        attributes = attributes.values()
+    elif not isinstance(attributes, (list, tuple)):
+        attributes = [attributes]
+    return para_id in attributes
+
+
+def parse_batch_receipt_and_exit(module, substrate, result, receipt, batch):
+    result['receipt'] = parse_receipt(receipt)
+    events = result['receipt']['triggered_events']
+    item_events = [event for event in events
+                   if event['module_id'] == 'Utility' and event['event_id'] in ('ItemCompleted', 'ItemFailed')]
+
+    parachains_state = check_parachains_exist(module, substrate, [para['id'] for para in result['parachains']])
+    for para in result['parachains']:
+        para['after'] = parachains_state[para['id']]
+        if para['id'] not in batch:
+            continue
+        index = batch.index(para['id'])
+        para['batch_index'] = index
+        para['triggered_events'] = [event for event in events
+                                    if event['module_id'] == 'Paras' and event_para_id(event, para['id'])]
+        if index < len(item_events):
+            para['triggered_events'].append(item_events[index])
+
+    if module._diff:
+        result['diff']['after'] = dict((para['id'], para['after']) for para in result['parachains'])
+
+    if result['receipt']['is_success']:
+        for event in receipt.triggered_events:
+            # Utility events like ItemCompleted have no attributes
+            if "Err" in (event.value["attributes"] or {}) or event.value['event_id'] == 'BatchInterrupted':
+                module.fail_json(msg='Triggered event failed: %s' % event.value["attributes"], **result)
+        module.exit_json(**result)
+    else:
+        module.fail_json(
+            msg='Transaction is not successful: https://polkadot.js.org/apps/?rpc=%s#/explorer/query/%s'
+                % (module.params['url'], result['receipt']['block_hash']), **result)
+
+
+def run_batch(module, substrate, keypair, parachains, result):
+    result['parachains'] = []
+    payloads = []
+    batch = []
+
+    parachains_state = check_parachains_exist(module, substrate, [params['id'] for params in parachains])
+    for params in parachains:
+        parachain_state = parachains_state[params['id']]
+        para = {'id': params['id'], 'state': params['state'], 'changed': False, 'before': parachain_state}
+        if params['state'] == 'present':
+            para['newCodeHash'] = test_genesis(module, params)
+            para['after'] = {'paraLifecycles': "Parachain", 'currentCodeHash': para['newCodeHash']}
+            if not parachain_state['paraLifecycles'] or parachain_state['currentCodeHash'] != para['newCodeHash']:
+                para['changed'] = True
+                payloads.append(compose_initialize(substrate, params))
+        else:
+            para['after'] = {'paraLifecycles': None, 'currentCodeHash': None}
+            if parachain_state['paraLifecycles']:
+                para['changed'] = True
+                payloads.append(compose_cleanup(substrate, params))
+        if para['changed']:
+            batch.append(params['id'])
+        result['parachains'].append(para)
+
+    if module._diff:
+        result['diff'] = {
+            "before": dict((para['id'], para['before']) for para in result['parachains']),
+            "after": dict((para['id'], para['after']) for para in result['parachains']),
+        }
+
+    # nothing to change or the check mode, exit here
+    result['changed'] = bool(batch)
+    if not batch or module.check_mode:
+        module.exit_json(**result)
+
+    receipt = submit_batch(module, substrate, keypair, payloads)
+    parse_batch_receipt_and_exit(module, substrate, result, receipt, batch)
+
+
 def run_module():
     module_args = dict(
         url=dict(type='str', default='ws://127.0.0.1:9944'),
-        key=dict(type='str', required=True),
+        key=dict(type='str'),
         key_type=dict(choices=['seed', 'uri'], default='seed'),
-        id=dict(type='int', required=True),
+        id=dict(type='int'),
+        parachains=dict(type='list', elements='dict', options=dict(
+            id=dict(type='int', required=True),
+            genesis_head=dict(type='str'),
+            validation_code=dict(type='str'),
+            genesis_head_file=dict(type='path'),
+            validation_code_file=dict(type='path'),
+            parachain=dict(type='bool'),
+            state=dict(choices=['present', 'absent']),
+        )),
         genesis_head=dict(type='str'),
         validation_code=dict(type='str'),
+        genesis_head_file=dict(type='path'),
+        validation_code_file=dict(type='path'),
         parachain=dict(type='bool', default=True),
         state=dict(choices=['present', 'absent'], default='present'),
+        **SUBSTRATE_ARGUMENT_SPEC
     )
 
-    required_if = [
-        ('state', 'present', ('genesis_head', 'validation_code')),
-    ]
-
     module = AnsibleModule(
         argument_spec=module_args,
         supports_check_mode=True,
-        required_if=required_if
+        mutually_exclusive=[
+            ('id', 'parachains'),
+            ('genesis_head', 'genesis_head_file'),
+            ('validation_code', 'validation_code_file'),
+        ],
+        required_if=[('metadata_cache_warm', False, ('key',))],
     )
 
+    if not module.params['metadata_cache_warm'] and module.params['id'] is None and module.params['parachains'] is None:
+        module.fail_json(msg="one of the following is required: id, parachains")
+
+    # genesis_head and validation_code are set per item in the parachains mode
+    if module.params['id'] is not None and module.params['state'] == 'present':
+        missing = [name for name in ('genesis_head', 'validation_code')
+                   if module.params[name] is None and module.params[name + '_file'] is None]
+        if missing:
+            module.fail_json(msg="state is present but all of the following are missing: %s" % ', '.join(missing))
+
     result = dict(
         changed=False
     )
 
     test_dependencies(module)
 
+    parachains = get_parachains(module) if module.params['parachains'] is not None else None
+
     substrate = get_substrate(module)
 
+    if module.params['metadata_cache_warm']:
+        warm_metadata_cache(module, substrate)
+
     keypair = get_keypair(module)
 
+    if parachains is not None:
+        run_batch(module, substrate, keypair, parachains, result)
+
     parachain_state = check_parachain_exists(module, substrate)
 
     result['parachain'] = dict(parachain_state)
 
     if module.params['state'] == 'present':
 
-        new_parachain_code_hash = test_genesis(module)
+        # the content of the genesis files is loaded into a copy, so it isn't returned in the invocation
+        params = dict(module.params)
+        new_parachain_code_hash = test_genesis(module, params)
         result['parachain'].update({'newCodeHash': new_parachain_code_hash})
 
         if module._diff:
@@ -383,7 +734,7 @@ def run_module():
         if module.check_mode:
             module.exit_json(**result)
 
-        receipt = add_parachain(module, substrate, keypair)
+        receipt = add_parachain(module, substrate, keypair, params)
         parse_receipt_and_exit(module, substrate, result, receipt)
 
     else:
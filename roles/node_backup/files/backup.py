@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Incremental backup of a node database.
+
+Files are stored as content-addressed objects ('<prefix>/objects/<hash[:2]>/<hash>') and every backup
+is described by a manifest ('<prefix>/<backup name>/manifest.json') which references the objects.
+Only the objects which are not referenced by the previous backup are uploaded.
+
+Every uploaded object is verified by the size and MD5 hash the storage reports for it. The uploaded objects are
+described by batched requests, so the backup doesn't need a listing of the whole prefix or a request per object.
+The manifest is signed with HMAC-SHA256 if a signing key is given.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import hmac
+import base64
+import logging
+import argparse
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+
+LOGGING_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+MANIFEST_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+LATEST_VERSION_FILE = 'latest_version.meta.txt'
+OBJECTS_PREFIX = 'objects'
+CHUNK_SIZE = 1024 * 1024
+
+
+class LocalStorage:
+    """
+    Local filesystem bucket, e.g. 'file:///mnt/backups'
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def put_file(self, src, key):
+        dst = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(dst), exist_ok=True)
+        # write to a temporary file first, so an interrupted upload doesn't leave a broken object
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(dst), prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f, open(src, 'rb') as s:
+                shutil.copyfileobj(s, f, CHUNK_SIZE)
+            os.replace(tmp, dst)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def stat(self, key):
+        path = os.path.join(self.root, key)
+        md5 = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                md5.update(chunk)
+        return {'size': os.path.getsize(path), 'md5': md5.hexdigest()}
+
+    def stat_many(self, root, names):
+        """
+        Return {name: size and MD5 hash} of the objects '<root>/<name>', missing objects are left out
+        """
+        stats = {}
+        for name in names:
+            try:
+                stats[name] = self.stat(f"{root}/{name}")
+            except FileNotFoundError:
+                pass
+        return stats
+
+    def put_bytes(self, data, key):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            f.write(data)
+        try:
+            self.put_file(f.name, key)
+        finally:
+            os.unlink(f.name)
+
+    def get_bytes(self, key):
+        try:
+            with open(os.path.join(self.root, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+
+class CommandStorage:
+    """
+    Bucket which is accessed by a CLI utility
+    """
+    copy_command = []
+    cat_command = []
+    stat_command = []
+
+    def __init__(self, root):
+        self.root = root
+
+    def url(self, key):
+        return f"{self.root}/{key}"
+
+    def put_file(self, src, key):
+        subprocess.run(self.copy_command + [src, self.url(key)], check=True, stdout=subprocess.DEVNULL)
+
+    def stat(self, key):
+        result = subprocess.run(self.stat_command + [self.url(key)], check=True, stdout=subprocess.PIPE)
+        return self.parse_stat(json.loads(result.stdout))
+
+    def put_bytes(self, data, key):
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(data)
+            f.flush()
+            self.put_file(f.name, key)
+
+    def get_bytes(self, key):
+        result = subprocess.run(self.cat_command + [self.url(key)], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if result.returncode != 0:
+            logging.debug(f"'{self.url(key)}' can't be read: {result.stderr.decode(errors='replace').strip()}")
+            return None
+        return result.stdout
+
+
+class RcloneStorage(CommandStorage):
+    """
+    rclone remote, e.g. 'rclone:S3backups:bucket'
+    """
+    copy_command = ['rclone', 'copyto', '--retries', '10', '--retries-sleep', '60s', '--contimeout', '10m']
+    cat_command = ['rclone', 'cat']
+    stat_command = ['rclone', 'lsjson', '--stat', '--hash', '--hash-type', 'md5']
+    list_command = ['rclone', 'lsjson', '-R', '--hash', '--hash-type', 'md5', '--files-only', '--no-mimetype']
+
+    @staticmethod
+    def parse_stat(data):
+        # some backends don't have MD5 hashes for multipart uploads
+        return {'size': data['Size'], 'md5': data.get('Hashes', {}).get('md5')}
+
+    def stat_many(self, root, names):
+        """
+        Return {name: size and MD5 hash} of the objects '<root>/<name>', missing objects are left out.
+        A recursive listing with --files-from-raw looks the files up one by one, the root isn't listed
+        """
+        with tempfile.NamedTemporaryFile('w') as f:
+            f.write(''.join(f"{name}\n" for name in names))
+            f.flush()
+            result = subprocess.run(self.list_command + ['--files-from-raw', f.name, self.url(root)],
+                                    check=True, stdout=subprocess.PIPE)
+        return {i['Path']: self.parse_stat(i) for i in json.loads(result.stdout)}
+
+
+class GcloudStorage(CommandStorage):
+    """
+    GCP bucket, e.g. 'gs://bucket'
+    """
+    copy_command = ['gcloud', 'storage', 'cp', '--no-user-output-enabled']
+    cat_command = ['gcloud', 'storage', 'cat']
+    stat_command = ['gcloud', 'storage', 'objects', 'describe', '--format=json']
+    list_command = ['gcloud', 'storage', 'objects', 'list', '--format=json']
+    # number of objects which are described by one command
+    list_batch_size = 500
+
+    @staticmethod
+    def parse_stat(data):
+        # composite objects don't have MD5 hashes
+        md5 = data.get('md5_hash', data.get('md5Hash'))
+        return {'size': int(data['size']), 'md5': base64.b64decode(md5).hex() if md5 else None}
+
+    def stat_many(self, root, names):
+        """
+        Return {name: size and MD5 hash} of the objects '<root>/<name>', missing objects are left out.
+        Objects are described in batches of list_batch_size URLs per command
+        """
+        # object names are relative to the bucket, the root URL can contain a path
+        bucket_path = self.url(root)[len('gs://'):].split('/', 1)[1]
+        stats = {}
+        for i in range(0, len(names), self.list_batch_size):
+            batch = names[i:i + self.list_batch_size]
+            result = subprocess.run(self.list_command + [f"{self.url(root)}/{name}" for name in batch],
+                                    stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            # a missing object fails the command, but the found objects are still listed
+            for data in json.loads(result.stdout or b'[]'):
+                name = data['name'][len(bucket_path) + 1:]
+                stats[name] = self.parse_stat(data)
+        return stats
+
+
+def get_storage(url):
+    if url.startswith('file://'):
+        return LocalStorage(url[len('file://'):])
+    if url.startswith('rclone:'):
+        return RcloneStorage(url[len('rclone:'):].rstrip('/'))
+    if url.startswith('gs://'):
+        return GcloudStorage(url.rstrip('/'))
+    raise ValueError(f"unsupported storage: '{url}'")
+
+
+def object_key(file_hash):
+    return f"{OBJECTS_PREFIX}/{file_hash[:2]}/{file_hash}"
+
+
+def hash_file(path):
+    """
+    Return the sha256 hash which addresses the object and the MD5 hash to verify the upload
+    """
+    file_hash = hashlib.sha256()
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            file_hash.update(chunk)
+            md5.update(chunk)
+    return file_hash.hexdigest(), md5.hexdigest()
+
+
+def sign_manifest(manifest, key):
+    """
+    Sign the manifest without the 'signature' field
+    """
+    payload = json.dumps({k: v for k, v in manifest.items() if k != 'signature'},
+                         sort_keys=True, separators=(',', ':')).encode()
+    if key:
+        return {'algorithm': 'hmac-sha256', 'value': hmac.new(key, payload, hashlib.sha256).hexdigest()}
+    return {'algorithm': 'sha256', 'value': hashlib.sha256(payload).hexdigest()}
+
+
+def verify_object(entry, response):
+    errors = []
+    if response['size'] != entry['size']:
+        errors.append(f"size {response['size']} != {entry['size']}")
+    if response['md5'] is not None and response['md5'] != entry['md5']:
+        errors.append(f"md5 {response['md5']} != {entry['md5']}")
+    return errors
+
+
+def scan(source):
+    """
+    List files of the source directory: relative path -> (size, mtime_ns)
+    """
+    files = {}
+    for root, dirs, names in os.walk(source):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            stat = os.stat(path, follow_symlinks=False)
+            files[os.path.relpath(path, source)] = (stat.st_size, stat.st_mtime_ns)
+    return files
+
+
+def fetch_previous_manifest(storage, prefix):
+    latest_version = storage.get_bytes(f"{prefix}/{LATEST_VERSION_FILE}")
+    if not latest_version:
+        return None
+    name = latest_version.decode().strip()
+    data = storage.get_bytes(f"{prefix}/{name}/{MANIFEST_FILE}")
+    if data is None:
+        logging.info(f"the previous backup '{name}' doesn't have a manifest, all files will be uploaded")
+        return None
+    manifest = json.loads(data)
+    if manifest.get('version') != MANIFEST_VERSION:
+        logging.info(f"the manifest version of the previous backup '{name}' isn't supported, all files will be uploaded")
+        return None
+    return manifest
+
+
+def backup(storage, prefix, name, source, jobs, signing_key=None):
+    start = time.monotonic()
+    previous = fetch_previous_manifest(storage, prefix)
+    previous_files = {i['path']: i for i in previous['files']} if previous else {}
+    known_objects = {i['hash'] for i in previous_files.values()}
+    files = scan(source)
+    logging.info(f"{len(files)} files were found in '{source}', the previous backup has {len(previous_files)} files")
+
+    def process(item):
+        path, (size, mtime_ns) = item
+        entry = previous_files.get(path)
+        if entry is not None and entry['size'] == size and entry['mtime_ns'] == mtime_ns:
+            return {'path': path, 'size': size, 'mtime_ns': mtime_ns, 'hash': entry['hash']}, None
+        file_hash, md5 = hash_file(os.path.join(source, path))
+        return {'path': path, 'size': size, 'mtime_ns': mtime_ns, 'hash': file_hash}, md5
+
+    entries = []
+    # object hash -> the entry of the file which is uploaded as the object and its MD5 hash.
+    # The same content can appear several times in one backup, it's uploaded once
+    uploads = {}
+    hashed_bytes = 0
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for entry, md5 in executor.map(process, files.items()):
+            entries.append(entry)
+            if md5 is not None:
+                hashed_bytes += entry['size']
+                if entry['hash'] not in known_objects and entry['hash'] not in uploads:
+                    uploads[entry['hash']] = dict(entry, md5=md5)
+
+        def upload(entry):
+            storage.put_file(os.path.join(source, entry['path']), f"{prefix}/{object_key(entry['hash'])}")
+
+        for _ in executor.map(upload, uploads.values()):
+            pass
+    uploaded_bytes = sum(i['size'] for i in uploads.values())
+    upload_duration = time.monotonic() - start
+
+    verify_start = time.monotonic()
+    stats = storage.stat_many(prefix, [object_key(i) for i in uploads])
+    errors = {}
+    for file_hash, entry in uploads.items():
+        response = stats.get(object_key(file_hash))
+        object_errors = verify_object(entry, response) if response is not None else ['the object is missing']
+        if object_errors:
+            errors[entry['path']] = object_errors
+    if errors:
+        raise RuntimeError(f"{len(errors)} objects don't match the local files: {errors}")
+    verify_duration = time.monotonic() - verify_start
+
+    manifest = {
+        'version': MANIFEST_VERSION,
+        'backupName': name,
+        'created': int(time.time()),
+        'previousBackupName': previous['backupName'] if previous else None,
+        'size': sum(i['size'] for i in entries),
+        'files': [dict(i, object=object_key(i['hash'])) for i in entries],
+    }
+    manifest['signature'] = sign_manifest(manifest, signing_key)
+    manifest_data = json.dumps(manifest, separators=(',', ':')).encode()
+    storage.put_bytes(manifest_data, f"{prefix}/{name}/{MANIFEST_FILE}")
+    verify_start = time.monotonic()
+    manifest_response = storage.stat(f"{prefix}/{name}/{MANIFEST_FILE}")
+    if manifest_response['size'] != len(manifest_data) or \
+            manifest_response['md5'] not in (None, hashlib.md5(manifest_data).hexdigest()):
+        raise RuntimeError(f"the manifest of the backup '{name}' doesn't match the local copy: {manifest_response}")
+    verify_duration += time.monotonic() - verify_start
+    summary = {
+        'backupName': name,
+        'files': len(entries),
+        'size': manifest['size'],
+        'hashedBytes': hashed_bytes,
+        'uploadedFiles': len(uploads),
+        'uploadedBytes': uploaded_bytes,
+        'reusedFiles': len(entries) - len(uploads),
+        'uploadDuration': upload_duration,
+        'verifyDuration': verify_duration,
+    }
+    logging.info(f"the backup '{name}' was completed in {time.monotonic() - start:.1f} seconds. summary: {summary}")
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--storage', required=True,
+                        help="bucket URL: 'gs://<bucket>', 'rclone:<remote>:<bucket>' or 'file://<path>'")
+    parser.add_argument('--prefix', required=True, help='path of the backups in the bucket, e.g. the service name')
+    parser.add_argument('--name', required=True, help='name of the new backup')
+    parser.add_argument('--source', required=True, help='local path of the database')
+    parser.add_argument('--jobs', type=int, default=10, help='number of parallel uploads')
+    parser.add_argument('--signing-key-file', help='file with the key to sign the manifest (HMAC-SHA256)')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    # the summary is printed to stdout, so logs go to stderr
+    logging.basicConfig(format=LOGGING_FORMAT, level=logging.DEBUG if args.debug else logging.INFO, stream=sys.stderr)
+    signing_key = None
+    if args.signing_key_file:
+        with open(args.signing_key_file, 'rb') as f:
+            signing_key = f.read().strip() or None
+    summary = backup(get_storage(args.storage), args.prefix.strip('/'), args.name, args.source, args.jobs, signing_key)
+    print(json.dumps(summary))
+
+
+if __name__ == '__main__':
+    main()
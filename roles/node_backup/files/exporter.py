@@ -9,86 +9,365 @@ import logging
 import threading
 import traceback
 import io
-from http.server import BaseHTTPRequestHandler, HTTPServer
-from prometheus_client import start_http_server, Gauge
+import signal
+import gzip
+import hashlib
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from prometheus_client import CollectorRegistry, PROCESS_COLLECTOR, PLATFORM_COLLECTOR, GC_COLLECTOR
+from prometheus_client.exposition import choose_encoder, gzip_accepted
+from prometheus_client.openmetrics import exposition as openmetrics
+from prometheus_client.core import GaugeMetricFamily, HistogramMetricFamily
+from prometheus_client.utils import floatToGoString
 
 
 LOGGING_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 
 
 cache_filename = os.path.dirname(__file__) + '/exporter.cache'
+quarantine_filename = cache_filename + '.quarantine'
 
 backup_labels = ['id', 'storage', 'bucket_name', 'service_name', 'version']
-backup_metrics = {
-    "timestamp":    Gauge('node_backup_timestamp',
-                          'Time of the last backup (unix timestamp)',
-                          backup_labels),
-    "size":         Gauge('node_backup_size',
-                          'Size of the last backup (byte)',
-                          backup_labels),
-    "last_block":   Gauge('node_backup_last_block',
-                          'Last block in the last backup (byte)',
-                          backup_labels),
-    "last_backup":  Gauge('node_backup_last_backup',
-                          'Last backup',
-                          backup_labels + ['backup_name', 'tar_backup_path', 'backup_path']),
-    "total_size":   Gauge('node_backup_total_size',
-                          'Size of all backups (byte)',
-                          ['storage', 'bucket_name'])
-}
-
-
-def update_cache(key, value):
-    if os.path.exists(cache_filename) and os.path.getsize(cache_filename) > 0:
-        with open(cache_filename, 'rb') as f:
-            data = pickle.load(f)
-    else:
-        data = {}
-    data[key] = value
-    with open(cache_filename, 'wb') as f:
-        pickle.dump(data, f)
+last_backup_labels = backup_labels + ['backup_name', 'tar_backup_path', 'backup_path']
+total_size_labels = ['storage', 'bucket_name']
+phase_labels = ['storage', 'bucket_name', 'service_name', 'phase']
+throughput_labels = ['storage', 'bucket_name', 'service_name']
+# phases of the backup script: report key -> phase label
+backup_phases = {'healthWait': 'health_wait', 'stop': 'stop', 'upload': 'upload', 'verify': 'verify', 'tar': 'tar'}
+phase_duration_buckets = (1, 5, 15, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400, 28800, 86400, float('inf'))
+# reports are received concurrently
+metrics_lock = threading.Lock()
 
 
-def fetch_cache():
-    if os.path.exists(cache_filename) and os.path.getsize(cache_filename) > 0:
-        with open(cache_filename, 'rb') as f:
-            data = pickle.load(f)
-            logging.info(f"Fetched from cache: {data}")
-            return data
-    else:
-        return {}
+class BackupCollector:
+    """
+    Collector over the state of the last backups.
+    The series of a backup id are replaced together, so old versions and backup names disappear with them.
+    """
+
+    def __init__(self):
+        # backup id -> label values and values of the last backup
+        self.backups = {}
+        # (storage, bucket_name) -> size of all backups
+        self.total_sizes = {}
+        # (storage, bucket_name, service_name, phase) -> [bucket counts, sum]
+        self.phase_durations = {}
+        # it's increased on every change of the state
+        self.generation = 0
+        self.restore_duration = None
+
+    def update(self, id, backup, total_size_label_values, total_size):
+        old_backup = self.backups.get(id)
+        if old_backup is not None and old_backup['last_backup_labels'] != backup['last_backup_labels']:
+            logging.info(f"clean metrics with label set: {str(list(old_backup['last_backup_labels']))}")
+        if backup['timings']:
+            self.observe_phases(backup['labels'][1:4], backup['timings'])
+            self.generation += 1
+        if old_backup != backup or self.total_sizes.get(total_size_label_values) != total_size:
+            self.backups[id] = backup
+            self.total_sizes[total_size_label_values] = total_size
+            self.generation += 1
+
+    def observe_phases(self, service_label_values, timings):
+        for phase, duration in timings.items():
+            histogram = self.phase_durations.setdefault(service_label_values + (phase,),
+                                                        [[0] * len(phase_duration_buckets), 0.0])
+            for index, bound in enumerate(phase_duration_buckets):
+                if duration <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += duration
+
+    def load(self, backups):
+        """
+        Replace the whole state at once, it's used to restore the state from the cache
+        """
+        for id, backup, total_size_label_values, total_size in backups:
+            self.backups[id] = backup
+            self.total_sizes[total_size_label_values] = total_size
+        self.generation += 1
 
+    def collect(self):
+        timestamp = GaugeMetricFamily('node_backup_timestamp',
+                                      'Time of the last backup (unix timestamp)',
+                                      labels=backup_labels)
+        size = GaugeMetricFamily('node_backup_size',
+                                 'Size of the last backup (byte)',
+                                 labels=backup_labels)
+        last_block = GaugeMetricFamily('node_backup_last_block',
+                                       'Last block in the last backup (byte)',
+                                       labels=backup_labels)
+        last_backup = GaugeMetricFamily('node_backup_last_backup',
+                                        'Last backup',
+                                        labels=last_backup_labels)
+        total_size = GaugeMetricFamily('node_backup_total_size',
+                                       'Size of all backups (byte)',
+                                       labels=total_size_labels)
+        phase_duration = HistogramMetricFamily('node_backup_phase_duration_seconds',
+                                               'Duration of the backup phases (second)',
+                                               labels=phase_labels)
+        upload_throughput = GaugeMetricFamily('node_backup_upload_throughput_bytes_per_second',
+                                              'Upload throughput of the last backup (byte/second)',
+                                              labels=throughput_labels)
+        for backup in self.backups.values():
+            timestamp.add_metric(backup['labels'], backup['timestamp'])
+            size.add_metric(backup['labels'], backup['size'])
+            last_block.add_metric(backup['labels'], backup['last_block'])
+            last_backup.add_metric(backup['last_backup_labels'], 1)
+            if backup['timings'].get('upload'):
+                upload_throughput.add_metric(backup['labels'][1:4],
+                                             backup['uploaded_bytes'] / backup['timings']['upload'])
+        for label_values, value in self.total_sizes.items():
+            total_size.add_metric(label_values, value)
+        for label_values, (bucket_counts, duration_sum) in self.phase_durations.items():
+            phase_duration.add_metric(label_values,
+                                      [(floatToGoString(bound), count) for bound, count in zip(phase_duration_buckets, bucket_counts)],
+                                      duration_sum)
+        restore_duration = GaugeMetricFamily('node_backup_exporter_restore_duration_seconds',
+                                             'Time of restoring the state from the cache at startup (second)')
+        if self.restore_duration is not None:
+            restore_duration.add_metric([], self.restore_duration)
+        return [timestamp, size, last_block, last_backup, total_size, phase_duration, upload_throughput, restore_duration]
 
-def clean_metrics(id, backup_name, version):
+
+class ExpositionCache:
     """
-    Purge records with old versions
+    Rendered and gzip-encoded exposition of the backup metrics, one per exposition format.
+    It's only rebuilt when the state of the collector changes.
     """
 
-    def check_record(key_value) -> bool:
-        return (
-                id in key_value['labels'] and
-                key_value['name'] != 'node_backup_total_size' and
-                (
-                    (key_value['name'] == 'node_backup_last_backup' and backup_name not in key_value['labels']) or
-                    version not in key_value['labels']
-                )
-        )
+    def __init__(self, registry, collector):
+        self.registry = registry
+        self.collector = collector
+        self.lock = threading.Lock()
+        self.entries = {}
 
-    for metric in backup_metrics.items():
-        current_metrics=[{'name': i.name, 'labels': list(i.labels.values()), 'value': i.value} for i in metric[1].collect()[0].samples]
-        old_metrics = list(filter(check_record, current_metrics))
-        for old_metric in old_metrics:
-            logging.info(f"clean {old_metric['name']} metric with label set: {str(old_metric['labels'])}")
-            metric[1].remove(*old_metric['labels'])
+    def get(self, encoder):
+        """
+        Return (generation, sha256, body, gzip_body) of the exposition rendered by the encoder
+        """
+        with self.lock:
+            entry = self.entries.get(encoder)
+            if entry is None or entry[0] != self.collector.generation:
+                with metrics_lock:
+                    generation = self.collector.generation
+                    body = encoder(self.registry)
+                entry = (generation, hashlib.sha256(body).hexdigest(), body, gzip.compress(body))
+                self.entries[encoder] = entry
+            return entry
 
 
-def set_metrics(data):
+backup_collector = BackupCollector()
+# all metrics, it's used for requests with the name[] filter, which needs the metric names of collectors
+registry = CollectorRegistry(auto_describe=True)
+# the process, platform and gc metrics change on every scrape, so they are rendered for every request
+# and only the backup metrics are cached
+runtime_registry = CollectorRegistry()
+backup_registry = CollectorRegistry()
+for collector in (PROCESS_COLLECTOR, PLATFORM_COLLECTOR, GC_COLLECTOR):
+    registry.register(collector)
+    runtime_registry.register(collector)
+registry.register(backup_collector)
+backup_registry.register(backup_collector)
+exposition = ExpositionCache(backup_registry, backup_collector)
+openmetrics_eof = b'# EOF\n'
+
+
+def render_metrics(accept, accept_encoding, names=None, if_none_match=None):
+    """
+    Return content type, ETag, body and whether the body is gzip-encoded.
+    The ETag is the hash of the cached backup exposition, the process, platform and gc metrics change on every scrape
+    and aren't a part of it. The body is None if the ETag is in if_none_match, a client which got it keeps the
+    backup metrics and the previous runtime metrics. Responses filtered by name[] have no ETag
+    """
+    encoder, content_type = choose_encoder(accept)
+    use_gzip = gzip_accepted(accept_encoding)
+    if names:
+        with metrics_lock:
+            body = encoder(registry.restricted_registry(names))
+        return content_type, None, gzip.compress(body) if use_gzip else body, use_gzip
+
+    generation, backup_sha256, backup_body, backup_gzip_body = exposition.get(encoder)
+    # the gzip-encoded representation has its own ETag
+    etag = f'"{backup_sha256[:32]}{"-gzip" if use_gzip else ""}"'
+    if if_none_match and etag in [i.strip() for i in if_none_match.split(',')]:
+        return content_type, etag, None, use_gzip
+    runtime_body = encoder(runtime_registry)
+    if encoder is openmetrics.generate_latest:
+        # the cached backup part ends the exposition with '# EOF'
+        runtime_body = runtime_body[:-len(openmetrics_eof)]
+    if use_gzip:
+        # a gzip stream may consist of several members, the cached backup part isn't compressed again
+        return content_type, etag, gzip.compress(runtime_body) + backup_gzip_body, True
+    return content_type, etag, runtime_body + backup_body, False
+
+
+class BackupCache:
+    """
+    In-memory backup state with a write-behind journal.
+
+    Updates are applied to memory and queued. A background thread appends them to
+    an append-only journal and periodically compacts the journal into a snapshot
+    which is replaced atomically, so a crash can't leave a truncated cache behind.
+    """
+
+    def __init__(self, filename, fsync_policy='interval', flush_interval=1.0, compact_records=1000):
+        if fsync_policy not in ('always', 'interval', 'never'):
+            raise ValueError(f"unknown fsync policy: '{fsync_policy}'")
+        self.filename = filename
+        self.journal_filename = filename + '.journal'
+        self.fsync_policy = fsync_policy
+        self.flush_interval = flush_interval
+        self.compact_records = compact_records
+        self.data = {}
+        self.pending = []
+        self.closed = False
+        self.condition = threading.Condition()
+        self.journal = None
+        self.journal_records = 0
+        self.journal_damaged = False
+        self.thread = None
+
+    def load(self):
+        """
+        Read the snapshot and replay the journal on top of it
+        """
+        data = {}
+        if os.path.exists(self.filename) and os.path.getsize(self.filename) > 0:
+            try:
+                with open(self.filename, 'rb') as f:
+                    data = pickle.load(f)
+            except Exception as e:
+                logging.error(f"cache snapshot reading error. error: '{e}', file: '{self.filename}'")
+                data = {}
+        records = 0
+        damaged = False
+        if os.path.exists(self.journal_filename):
+            with open(self.journal_filename, 'r', encoding='utf8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        if record.get('deleted'):
+                            data.pop(tuple(record['key']), None)
+                        else:
+                            data[tuple(record['key'])] = record['value']
+                    except (json.decoder.JSONDecodeError, KeyError, TypeError) as e:
+                        # only the last record can be partially written
+                        logging.error(f"cache journal reading error. error: '{e}', record: '{line.strip()}'")
+                        damaged = True
+                        break
+                    records += 1
+        with self.condition:
+            self.data = data
+            self.journal_records = records
+            self.journal_damaged = damaged
+        logging.info(f"Fetched from cache: {data}")
+        return dict(data)
+
+    def start(self):
+        self.journal = open(self.journal_filename, 'a', encoding='utf8')
+        if self.journal_damaged:
+            # don't append records after a partially written one
+            self._compact(dict(self.data))
+        self.thread = threading.Thread(target=self._run, name='cache-writer', daemon=True)
+        self.thread.start()
+
+    def put(self, key, value):
+        with self.condition:
+            self.data[key] = value
+            self.pending.append((key, value))
+            if self.fsync_policy == 'always':
+                self.condition.notify()
+
+    def put_many(self, records):
+        with self.condition:
+            for key, value in records:
+                self.data[key] = value
+            self.pending.extend(records)
+            if self.fsync_policy == 'always':
+                self.condition.notify()
+
+    def delete(self, keys):
+        with self.condition:
+            for key in keys:
+                self.data.pop(key, None)
+            self.pending.extend((key, None) for key in keys)
+
+    def close(self):
+        """
+        Flush pending records, compact the journal and stop the writer thread
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        if self.thread:
+            self.thread.join()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                if not self.pending and not self.closed:
+                    self.condition.wait(self.flush_interval)
+                pending, self.pending = self.pending, []
+                closed = self.closed
+                records = self.journal_records + len(pending)
+                compact = records >= self.compact_records or (closed and records > 0)
+                # the snapshot has to be taken together with the pending records,
+                # so the journal never contains records newer than the snapshot
+                snapshot = dict(self.data) if compact else None
+            try:
+                if pending:
+                    self._append(pending)
+                if snapshot is not None:
+                    self._compact(snapshot)
+            except Exception as e:
+                tb_output = io.StringIO()
+                traceback.print_tb(e.__traceback__, file=tb_output)
+                logging.error(f"cache writing error. error: '{e}'")
+                logging.error(f"cache writing error. traceback:\n{tb_output.getvalue()}")
+                tb_output.close()
+            if closed:
+                self.journal.close()
+                return
+
+    def _append(self, records):
+        self.journal.write(''.join(json.dumps({'key': list(key), 'value': value} if value is not None
+                                              else {'key': list(key), 'deleted': True}) + '\n'
+                                   for key, value in records))
+        self.journal.flush()
+        if self.fsync_policy != 'never':
+            os.fsync(self.journal.fileno())
+        self.journal_records += len(records)
+
+    def _compact(self, snapshot):
+        tmp_filename = self.filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            pickle.dump(snapshot, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_filename, self.filename)
+        dir_fd = os.open(os.path.dirname(os.path.abspath(self.filename)), os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self.journal.close()
+        self.journal = open(self.journal_filename, 'w', encoding='utf8')
+        self.journal_records = 0
+        logging.info(f"cache was compacted. records: {len(snapshot)}")
+
+
+cache = BackupCache(cache_filename,
+                    fsync_policy=os.environ.get('NODE_BACKUP_EXPORTER_CACHE_FSYNC', 'interval'),
+                    flush_interval=float(os.environ.get('NODE_BACKUP_EXPORTER_CACHE_FLUSH_INTERVAL', '1')),
+                    compact_records=int(os.environ.get('NODE_BACKUP_EXPORTER_CACHE_COMPACT_RECORDS', '1000')))
+
+
+def parse_report(data):
+    """
+    Validate a report and convert it to the collector state without touching the metrics
+    """
     id = f"{data['storage']}-{data['bucketName']}-{data['serviceName']}"
-    common_labels={'id': id,
-                   'storage': data['storage'],
-                   'bucket_name': data['bucketName'],
-                   'service_name': data['serviceName'],
-                   'version': data['version']}
     if  data['bucketDomain'] != '':
         backup_path=f"https://{data['bucketDomain']}/{data['serviceName']}/{data['backupName']}"
         tar_backup_path=f"https://{data['bucketDomain']}/tar/{data['serviceName']}/{data['backupName']}.tar"
@@ -97,35 +376,110 @@ def set_metrics(data):
         tar_backup_path=f"https://storage.googleapis.com/{data['bucketName']}/tar/{data['serviceName']}/{data['backupName']}.tar"
     else:
         raise Exception("'bucketDomain' has to be defined")
-    clean_metrics(id, data['backupName'], data['version'])
-    backup_metrics['timestamp'].labels(**common_labels).set(int(data['timeStamp']))
-    backup_metrics['size'].labels(**common_labels).set(int(data['size']))
-    backup_metrics['last_block'].labels(**common_labels).set(int(data['lastBlock']))
-    backup_metrics['last_backup'].labels(**common_labels,
-                                         backup_name=data['backupName'],
-                                         backup_path=backup_path,
-                                         tar_backup_path=tar_backup_path).set(1)
-    backup_metrics['total_size'].labels(storage=data['storage'],
-                                        bucket_name=data['bucketName']).set(int(data['totalSize']))
-    update_cache((data['storage'], data['bucketName'], data['serviceName']), data)
+    # the order of values follows 'backup_labels' and 'last_backup_labels'
+    common_label_values = tuple(str(i) for i in (id, data['storage'], data['bucketName'], data['serviceName'], data['version']))
+    # the phase timings are optional, a phase can be skipped ('null')
+    timings = {phase: float(data['timings'][key]) for key, phase in backup_phases.items()
+               if (data.get('timings') or {}).get(key) is not None}
+    backup = {
+        'labels': common_label_values,
+        'last_backup_labels': common_label_values + tuple(str(i) for i in (data['backupName'], tar_backup_path, backup_path)),
+        'timestamp': int(data['timeStamp']),
+        'size': int(data['size']),
+        # the whole backup is uploaded if the report doesn't have 'uploadedBytes', e.g. for full backups
+        'uploaded_bytes': int(data['uploadedBytes']) if data.get('uploadedBytes') is not None else int(data['size']),
+        'last_block': int(data['lastBlock']),
+        'timings': timings,
+    }
+    return id, backup, (str(data['storage']), str(data['bucketName'])), int(data['totalSize'])
+
+
+def apply_metrics(data):
+    backup_collector.update(*parse_report(data))
+    return (data['storage'], data['bucketName'], data['serviceName'])
+
+
+def restore_metrics():
+    """
+    Restore the state from the cache in one pass without writing it back.
+    Invalid records are moved from the cache to the quarantine file.
+    """
+    start = time.monotonic()
+    backups = []
+    quarantine = []
+    for key, data in cache.load().items():
+        try:
+            backups.append(parse_report(data))
+        except Exception as e:
+            logging.error(f"cache fetching error. error: '{e}', key: {key}, value: {data}")
+            quarantine.append((key, data, str(e)))
+    with metrics_lock:
+        backup_collector.load(backups)
+    if quarantine:
+        with open(quarantine_filename, 'a', encoding='utf8') as f:
+            for key, data, error in quarantine:
+                f.write(json.dumps({'key': list(key), 'value': data, 'error': error}, default=str) + '\n')
+        cache.delete([i[0] for i in quarantine])
+        logging.error(f"{len(quarantine)} invalid records were moved from the cache to {quarantine_filename}")
+    duration = time.monotonic() - start
+    with metrics_lock:
+        backup_collector.restore_duration = duration
+        backup_collector.generation += 1
+    logging.info(f"the state was restored from the cache in {duration:.3f} seconds. backups: {len(backups)}")
+
+
+def set_metrics(data):
+    with metrics_lock:
+        cache.put(apply_metrics(data), data)
     logging.info(f"request was processed successfully. data: {data}")
 
 
+def set_metrics_batch(reports):
+    """
+    Apply a list of reports under one lock and flush them to the cache at once.
+    Invalid reports are skipped and returned as errors.
+    """
+    if not isinstance(reports, list):
+        raise ValueError("a JSON array of reports is expected")
+    records = []
+    errors = []
+    with metrics_lock:
+        for index, data in enumerate(reports):
+            try:
+                records.append((apply_metrics(data), data))
+            except Exception as e:
+                logging.error(f"batch item processing error. error: '{e}', index: {index}, data: {data}")
+                errors.append({'index': index, 'error': str(e)})
+        cache.put_many(records)
+    logging.info(f"batch request was processed. reports: {len(records)}, errors: {len(errors)}")
+    return errors
+
+
 class HttpProcessor(BaseHTTPRequestHandler):
     """
     HTTP Server
     """
     BaseHTTPRequestHandler.server_version = 'Python API'
+    # keep-alive
+    protocol_version = 'HTTP/1.1'
+    # don't let a stalled client hold a connection forever
+    timeout = 60
 
     def log_message(self, format, *args):
         message = f"{self.address_string()} {format % args}"
         logging.info(message)
 
+    def send_json(self, code, body):
+        response = json.dumps(body).encode("utf8")
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
 
     def do_POST(self):
         if self.headers.get('Content-Type') != 'application/json':
             self.send_error(400, "Only application/json supported")
-            self.end_headers()
             return
         data = ""
         try:
@@ -133,11 +487,12 @@ class HttpProcessor(BaseHTTPRequestHandler):
             length = int(self.headers['content-length'])
             data = self.rfile.read(length)
 
-            set_metrics(json.loads(data))
-            self.send_response(200)
-            self.send_header('Content-type', 'application/json; charset=utf-8')
-            self.end_headers()
-            self.wfile.write(json.dumps({"status": "OK"}).encode("utf8"))
+            if urlparse(self.path).path.rstrip('/') == '/batch':
+                errors = set_metrics_batch(json.loads(data))
+                self.send_json(200, {"status": "OK" if not errors else "PARTIAL", "errors": errors})
+            else:
+                set_metrics(json.loads(data))
+                self.send_json(200, {"status": "OK"})
         except json.decoder.JSONDecodeError as e:
             tb_output = io.StringIO()
             traceback.print_tb(e.__traceback__, file=tb_output)
@@ -156,14 +511,54 @@ class HttpProcessor(BaseHTTPRequestHandler):
             return
 
 
+class MetricsHandler(BaseHTTPRequestHandler):
+    """
+    Metrics Server
+    """
+    BaseHTTPRequestHandler.server_version = 'Python API'
+    protocol_version = 'HTTP/1.1'
+    timeout = 60
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        content_type, etag, body, use_gzip = render_metrics(self.headers.get('Accept'),
+                                                            self.headers.get('Accept-Encoding'),
+                                                            parse_qs(url.query).get('name[]'),
+                                                            self.headers.get('If-None-Match'))
+        if body is None:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Vary', 'Accept, Accept-Encoding')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if etag is not None:
+            self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        if use_gzip:
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
 def start_servers():
     """
     Start HTTP Servers
     """
     # Start up the server to expose the metrics.
-    start_http_server(9109)  # Metrics server
+    metrics_server = ThreadingHTTPServer(('0.0.0.0', 9109), MetricsHandler)  # Metrics server
+    threading.Thread(target=metrics_server.serve_forever, daemon=True).start()
     server_address = ('127.0.0.1', 60101)  # Data reception server
-    server = HTTPServer(server_address, HttpProcessor)
+    server = ThreadingHTTPServer(server_address, HttpProcessor)
     server.serve_forever()
 
 
@@ -178,20 +573,15 @@ if __name__ == '__main__':
     logging.basicConfig(format=LOGGING_FORMAT, level=logging.INFO, handlers=[console])
 
 
-    for backup in fetch_cache().items():
-        try:
-            set_metrics(backup[1])
-        except KeyError as e:
-            logging.error(f"cache fetching error. error: {e}, key: {backup[0]}, value: {backup[1]}")
-        except Exception as e:
-            tb_output = io.StringIO()
-            traceback.print_tb(e.__traceback__, file=tb_output)
-            logging.error(f"cache fetching error. error: '{e}'")
-            logging.error(f"cache fetching error. traceback:\n{tb_output.getvalue()}")
-            tb_output.close()
-            sys.exit(1)
+    restore_metrics()
+    cache.start()
+    # flush the journal on 'systemctl stop'
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
 
     thread = threading.Thread(target=start_servers, args=())
     thread.daemon = True
     thread.start()
-    thread.join()
+    try:
+        thread.join()
+    finally:
+        cache.close()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark of the state exporter against a synthetic process table, generated keystores and databases.
+
+The exporter is imported from '../files/exporter.py' and its psutil module is replaced by a fake one,
+so the benchmark doesn't need running nodes. It reports the latency of collection cycles and scrapes
+in both modes, database size updates and the peak of memory allocated by a cycle.
+The results are checked against the generated state (nodes, session keys, database sizes, the TTL of the
+scrape mode), the benchmark exits with 1 if a check fails, so it can be run by CI.
+
+    python3 benchmark.py --processes 5000 --nodes 20 --cycles 50
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import tracemalloc
+import contextlib
+from collections import namedtuple
+
+import psutil
+from prometheus_client import generate_latest, REGISTRY
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'files'))
+import exporter  # noqa: E402
+
+# fake pids are above the maximal pid of Linux, so they never match real processes in /proc
+FIRST_PID = 10000000
+
+pcputimes = namedtuple('pcputimes', ['user', 'system'])
+pmem = namedtuple('pmem', ['rss'])
+pctxsw = namedtuple('pctxsw', ['voluntary', 'involuntary'])
+pio = namedtuple('pio', ['read_bytes', 'write_bytes'])
+pthread = namedtuple('pthread', ['id', 'user_time', 'system_time'])
+
+
+class FakeProcess:
+    def __init__(self, table, pid):
+        if pid not in table.processes:
+            raise psutil.NoSuchProcess(pid)
+        self.table = table
+        self.pid = pid
+        self.create_time = table.processes[pid]['create_time']
+
+    def _info(self):
+        info = self.table.processes.get(self.pid)
+        if info is None or info['create_time'] != self.create_time:
+            raise psutil.NoSuchProcess(self.pid)
+        if info['zombie']:
+            raise psutil.ZombieProcess(self.pid)
+        return info
+
+    def is_running(self):
+        info = self.table.processes.get(self.pid)
+        return info is not None and info['create_time'] == self.create_time
+
+    def cmdline(self):
+        return list(self._info()['cmdline'])
+
+    @contextlib.contextmanager
+    def oneshot(self):
+        yield
+
+    def cpu_times(self):
+        cpu = self._info()['cpu']
+        return pcputimes(cpu * 0.8, cpu * 0.2)
+
+    def num_threads(self):
+        return len(self._info()['threads'])
+
+    def memory_info(self):
+        return pmem(self._info()['memory'])
+
+    def cpu_percent(self):
+        return 12.5
+
+    def num_ctx_switches(self):
+        cpu = self._info()['cpu']
+        return pctxsw(int(cpu * 1000), int(cpu * 10))
+
+    def io_counters(self):
+        cpu = self._info()['cpu']
+        return pio(int(cpu * 1e6), int(cpu * 2e6))
+
+    def num_fds(self):
+        return 1024
+
+    def threads(self):
+        cpu = self._info()['cpu']
+        return [pthread(i, cpu / 100, cpu / 1000) for i in self._info()['threads']]
+
+
+class FakeProcessTable:
+    """
+    Synthetic process table: background processes, nodes with docker or bash parents and zombies
+    """
+
+    def __init__(self, processes, nodes, base_dir, zombies=0.01, parents=0.5, threads=50):
+        self.processes = {}
+        self.next_pid = FIRST_PID
+        self.threads = threads
+        self.node_base_paths = []
+        chains = list(exporter.node_chain_folders)
+        for i in range(nodes):
+            chain = chains[i % len(chains)]
+            base_path = os.path.join(base_dir, 'node-%d' % i)
+            self.node_base_paths.append(('node-%d' % i, base_path, chain))
+            node_cmdline = ['/usr/local/bin/polkadot', '--name', 'node-%d' % i, '--chain', chain,
+                            '--base-path', base_path, '--validator', '--rpc-port', str(9933 + i)]
+            if i % 3 == 0:
+                # the flags can be repeated, the last one wins
+                node_cmdline[1:1] = ['--name', 'old-name-%d' % i]
+            if random.random() < parents:
+                parent = ['docker', 'run', '--rm', 'parity/polkadot'] if i % 2 else ['/bin/bash', '-c']
+                self.add(parent + node_cmdline[1:])
+            self.add(node_cmdline, threads=threads)
+        while len(self.processes) < processes:
+            self.add(['/usr/bin/worker-%d' % random.randint(0, 100), '--config', '/etc/worker.conf', '-v'],
+                     zombie=random.random() < zombies)
+
+    def add(self, cmdline, zombie=False, threads=1):
+        pid = self.next_pid
+        self.next_pid += 1
+        self.processes[pid] = {'cmdline': cmdline, 'create_time': time.time(), 'zombie': zombie,
+                               'memory': random.randint(10 ** 6, 10 ** 10), 'cpu': random.random() * 1000,
+                               'threads': list(range(pid * 1000, pid * 1000 + threads))}
+        return pid
+
+    def churn(self, share):
+        """
+        Replace a share of the background processes with new ones
+        """
+        background = [k for k, v in self.processes.items() if '--chain' not in v['cmdline']]
+        for pid in random.sample(background, int(len(background) * share)):
+            del self.processes[pid]
+            self.add(['/usr/bin/short-lived', '--job', str(pid)])
+
+    def tick(self):
+        for info in self.processes.values():
+            info['cpu'] += random.random()
+
+    def pids(self):
+        return sorted(self.processes)
+
+    def install(self):
+        table = self
+
+        class FakePsutil:
+            NoSuchProcess = psutil.NoSuchProcess
+            AccessDenied = psutil.AccessDenied
+            ZombieProcess = psutil.ZombieProcess
+
+            @staticmethod
+            def pids():
+                return table.pids()
+
+            @staticmethod
+            def Process(pid):
+                return FakeProcess(table, pid)
+
+        exporter.psutil = FakePsutil
+
+
+def chain_path(base_path, chain):
+    return os.path.join(base_path, 'chains', exporter.node_chain_folders[chain])
+
+
+def create_keystores(node_base_paths, extra_files=20):
+    """
+    Create a keystore for every node, key formats are taken in turns from exporter.key_formats.
+    Returns {node name: expected session key}
+    """
+    session_keys = {}
+    for i, (name, base_path, chain) in enumerate(node_base_paths):
+        keystore = os.path.join(chain_path(base_path, chain), 'keystore')
+        os.makedirs(keystore, exist_ok=True)
+        key_format = exporter.key_formats[i % len(exporter.key_formats)]
+        public_keys = []
+        for prefix in key_format:
+            public_keys.append(os.urandom(32).hex())
+            with open(os.path.join(keystore, prefix + public_keys[-1]), 'w') as f:
+                f.write('"0x%s"' % os.urandom(32).hex())
+        session_keys[name] = '0x' + ''.join(public_keys)
+        # files which aren't keys, e.g. keys of other types
+        for j in range(extra_files):
+            open(os.path.join(keystore, '74657374' + os.urandom(32).hex()), 'w').close()
+    return session_keys
+
+
+def write_file(path, size):
+    with open(path, 'ab') as f:
+        f.write(b'\0' * size)
+
+
+def create_databases(node_base_paths, dirs=5, files=20):
+    """
+    Create a rocksdb-like database for every node. Returns {database path: (size, files)}
+    """
+    sizes = {}
+    for name, base_path, chain in node_base_paths:
+        db_path = os.path.join(chain_path(base_path, chain), 'db')
+        total_size = total_files = 0
+        for i in range(dirs):
+            directory = os.path.join(db_path, 'full', 'column-%d' % i)
+            os.makedirs(directory)
+            for j in range(files):
+                size = random.randint(0, 4096)
+                write_file(os.path.join(directory, '%06d.sst' % j), size)
+                total_size += size
+                total_files += 1
+        sizes[db_path] = (total_size, total_files)
+    return sizes
+
+
+def db_size_sample(name, database='db'):
+    node = exporter.state_collector.snapshot[name]
+    return REGISTRY.get_sample_value('polkadot_state_node_db_size_bytes',
+                                     {'name': name, 'pid': str(node['pid']), 'database': database})
+
+
+class Checks:
+    """
+    Results of the checks of the exporter's state, failed checks are kept to be reported
+    """
+
+    def __init__(self):
+        self.passed = 0
+        self.failed = []
+
+    def expect(self, condition, message):
+        if condition:
+            self.passed += 1
+        else:
+            self.failed.append(message)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p), len(values) - 1)]
+
+
+def summary(values):
+    return {'mean': sum(values) / len(values), 'p50': percentile(values, 0.5),
+            'p95': percentile(values, 0.95), 'max': max(values)}
+
+
+def check_snapshot(checks, table, session_keys):
+    snapshot = exporter.state_collector.snapshot
+    names = set(i[0] for i in table.node_base_paths)
+    checks.expect(set(snapshot) == names,
+                  'nodes: expected %d, found %d (%s)' % (len(names), len(snapshot), sorted(set(snapshot) ^ names)))
+    checks.expect(not any(i.startswith('old-name-') for i in snapshot), 'the last --name flag has to win')
+    wrong_keys = [i for i in names if i in snapshot and snapshot[i]['session_key'] != session_keys[i]]
+    checks.expect(not wrong_keys, 'wrong session keys of %s' % sorted(wrong_keys))
+
+
+def run_db_size(checks, table, db_sizes):
+    """
+    Measure updates of database sizes and check them: a new file is found by an update,
+    a file which grows in place is found only by a rescan
+    """
+    tracker = exporter.db_size_tracker
+    checks.expect(tracker.paths.issuperset(db_sizes), 'database paths of all nodes have to be tracked')
+    timings = {}
+    start = time.perf_counter()
+    tracker.update(rescan=True)
+    timings['initial'] = time.perf_counter() - start
+    checks.expect(tracker.sizes == db_sizes, 'database sizes after the initial scan')
+
+    start = time.perf_counter()
+    tracker.update()
+    timings['unchanged'] = time.perf_counter() - start
+
+    name, base_path, chain = table.node_base_paths[0]
+    db_path = os.path.join(chain_path(base_path, chain), 'db')
+    column = os.path.join(db_path, 'full', 'column-0')
+    write_file(os.path.join(column, 'new.sst'), 1000)
+    # the mtime of the directory is changed by adding the file, the timestamp resolution can be coarse
+    os.utime(column, ns=(time.time_ns(), time.time_ns() + 10 ** 9))
+    write_file(os.path.join(db_path, 'full', 'column-1', '000000.sst'), 500)
+    size, files = db_sizes[db_path]
+    start = time.perf_counter()
+    tracker.update()
+    timings['changed'] = time.perf_counter() - start
+    checks.expect(tracker.sizes[db_path] == (size + 1000, files + 1), 'a new file has to be found by an update')
+
+    start = time.perf_counter()
+    tracker.update(rescan=True)
+    timings['rescan'] = time.perf_counter() - start
+    checks.expect(tracker.sizes[db_path] == (size + 1500, files + 1), 'a grown file has to be found by a rescan')
+    checks.expect(db_size_sample(name) == size + 1500, 'the database size has to be exported')
+    return timings
+
+
+def run_scrape_mode(checks, args):
+    """
+    Measure scrapes of the scrape mode and check that the state is collected once per TTL,
+    concurrent scrapes share one cycle
+    """
+    collector = exporter.state_collector
+    cycles = []
+    update_metrics = exporter.update_metrics
+
+    def counted_update_metrics():
+        cycles.append(time.monotonic())
+        update_metrics()
+
+    exporter.update_metrics = counted_update_metrics
+    collector.ttl = args.ttl
+    collector.collected_at = None
+    try:
+        start = time.perf_counter()
+        generate_latest(REGISTRY)
+        miss = time.perf_counter() - start
+        checks.expect(len(cycles) == 1, 'the first scrape has to collect the state')
+
+        hits = []
+        while not hits or time.monotonic() - collector.collected_at < args.ttl / 2:
+            start = time.perf_counter()
+            generate_latest(REGISTRY)
+            hits.append(time.perf_counter() - start)
+        checks.expect(len(cycles) == 1, 'scrapes within the TTL have to use the collected state')
+
+        time.sleep(args.ttl)
+        scrapers = [threading.Thread(target=generate_latest, args=(REGISTRY,)) for i in range(8)]
+        for i in scrapers:
+            i.start()
+        for i in scrapers:
+            i.join()
+        checks.expect(len(cycles) == 2, 'concurrent scrapes after the TTL have to share one cycle, %d were run'
+                      % (len(cycles) - 1))
+        checks.expect(REGISTRY.get_sample_value('polkadot_state_collection_duration_seconds') is not None,
+                      'the duration of the collection has to be exported')
+    finally:
+        exporter.update_metrics = update_metrics
+        collector.ttl = None
+    return miss, hits
+
+
+def check_exec(checks, table):
+    """
+    A process which execs a node keeps its pid, it has to be found after the recheck interval
+    """
+    pid = table.add(['/bin/sh', '/usr/local/bin/start-node.sh'])
+    exporter.discovery.discover()
+    table.processes[pid]['cmdline'] = ['/usr/local/bin/polkadot', '--name', 'exec-node', '--chain', 'polkadot']
+    recheck_interval = exporter.discovery.recheck_interval
+    exporter.discovery.recheck_interval = 0
+    try:
+        checks.expect('exec-node' in exporter.discovery.discover(), 'a node started by exec has to be found')
+    finally:
+        exporter.discovery.recheck_interval = recheck_interval
+        del table.processes[pid]
+
+
+def check_pid_reuse(checks, table):
+    """
+    A node which reuses the pid of a process which isn't a node has to be found by the next cycle
+    """
+    pid = table.add(['/usr/bin/short-lived', '--job', 'reused'])
+    exporter.discovery.discover()
+    table.processes[pid] = dict(table.processes[pid], create_time=time.time() + 1,
+                                cmdline=['/usr/local/bin/polkadot', '--name', 'reused-pid-node', '--chain', 'kusama'])
+    try:
+        checks.expect('reused-pid-node' in exporter.discovery.discover(), 'a node with a reused pid has to be found')
+    finally:
+        del table.processes[pid]
+
+
+def run(args):
+    random.seed(args.seed)
+    base_dir = tempfile.mkdtemp(prefix='state-exporter-benchmark-')
+    checks = Checks()
+    try:
+        table = FakeProcessTable(args.processes, args.nodes, base_dir)
+        table.install()
+        session_keys = create_keystores(table.node_base_paths)
+        db_sizes = create_databases(table.node_base_paths)
+
+        def prepare():
+            if args.no_cache:
+                exporter.discovery.processes.clear()
+                exporter.keystore_cache.keystores.clear()
+            table.churn(args.churn)
+            table.tick()
+
+        def cycle():
+            prepare()
+            start = time.perf_counter()
+            exporter.state_collector.run_cycle()
+            return time.perf_counter() - start
+
+        first_cycle = cycle()
+        check_snapshot(checks, table, session_keys)
+
+        # latencies are measured without tracemalloc, it slows down the code a lot
+        cycles = []
+        scrapes = []
+        for i in range(args.cycles):
+            cycles.append(cycle())
+            start = time.perf_counter()
+            generate_latest(REGISTRY)
+            scrapes.append(time.perf_counter() - start)
+
+        allocations = []
+        tracemalloc.start()
+        for i in range(args.cycles):
+            prepare()
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            exporter.state_collector.run_cycle()
+            allocations.append(tracemalloc.get_traced_memory()[1] - before)
+        tracemalloc.stop()
+        check_snapshot(checks, table, session_keys)
+
+        db_size_timings = run_db_size(checks, table, db_sizes)
+        scrape_miss, scrape_hits = run_scrape_mode(checks, args)
+        check_exec(checks, table)
+        check_pid_reuse(checks, table)
+
+        keystore_parses = []
+        for name, base_path, chain in table.node_base_paths:
+            keystore = os.path.join(chain_path(base_path, chain), 'keystore')
+            start = time.perf_counter()
+            exporter.parse_session_key(keystore)
+            keystore_parses.append(time.perf_counter() - start)
+
+        return {
+            'processes': len(table.processes),
+            'nodes': len(exporter.state_collector.snapshot),
+            'session_keys': len([i for i in exporter.state_collector.snapshot.values() if i['session_key']]),
+            'first_cycle_seconds': first_cycle,
+            'cycle_seconds': summary(cycles),
+            'cycle_allocated_peak_bytes': summary(allocations),
+            'scrape_seconds': summary(scrapes),
+            'scrape_mode_miss_seconds': scrape_miss,
+            'scrape_mode_hit_seconds': summary(scrape_hits),
+            'db_size_update_seconds': db_size_timings,
+            'parse_session_key_seconds': summary(keystore_parses),
+            'checks_passed': checks.passed,
+            'checks_failed': checks.failed,
+        }
+    finally:
+        shutil.rmtree(base_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the state exporter with a fake process table')
+    parser.add_argument('--processes', type=int, default=5000, help='number of processes in the table')
+    parser.add_argument('--nodes', type=int, default=20, help='number of node processes')
+    parser.add_argument('--cycles', type=int, default=50, help='number of measured collection cycles')
+    parser.add_argument('--churn', type=float, default=0.01, help='share of processes replaced before every cycle')
+    parser.add_argument('--no-cache', action='store_true', help='clear discovery and keystore caches before every cycle')
+    parser.add_argument('--ttl', type=float, default=0.2, help='TTL of the scrape mode')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', action='store_true', help='print the result as JSON')
+    args = parser.parse_args()
+
+    result = run(args)
+    if args.json:
+        print(json.dumps(result, indent=2))
+    else:
+        print('processes: %(processes)d, nodes: %(nodes)d, session keys: %(session_keys)d' % result)
+        print('first cycle: %.3f ms' % (result['first_cycle_seconds'] * 1000))
+        print('scrape mode, first scrape: %.3f ms' % (result['scrape_mode_miss_seconds'] * 1000))
+        for name, unit, scale in [('cycle_seconds', 'ms', 1000), ('scrape_seconds', 'ms', 1000),
+                                  ('scrape_mode_hit_seconds', 'ms', 1000), ('parse_session_key_seconds', 'ms', 1000),
+                                  ('cycle_allocated_peak_bytes', 'KiB', 1 / 1024)]:
+            values = result[name]
+            print('%-28s mean %9.3f  p50 %9.3f  p95 %9.3f  max %9.3f %s' % (
+                name, values['mean'] * scale, values['p50'] * scale, values['p95'] * scale, values['max'] * scale, unit))
+        print('db size update: ' + ', '.join('%s %.3f ms' % (k, v * 1000)
+                                             for k, v in result['db_size_update_seconds'].items()))
+        print('checks: %d passed, %d failed' % (result['checks_passed'], len(result['checks_failed'])))
+    for message in result['checks_failed']:
+        print('FAILED: ' + message, file=sys.stderr)
+    if result['checks_failed']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,11 +3,13 @@
 
 import schedule
 import time
-import sys
 import os
 import logging
+import argparse
+import threading
 import traceback
-from prometheus_client import start_http_server, Gauge
+from prometheus_client import start_http_server, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
 import psutil
 
 LOGGING_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -19,145 +21,460 @@ node_chain_folders = {
     'rococo':  'rococo_v1_12'
 }
 
-process_metrics = {
-    'polkadot_state_process_cmdline': Gauge(
-        'polkadot_state_process_cmdline',
-        'cmdline of a node process',
-        ['name', 'pid', 'cmd_line']),
-    'polkadot_state_process_threads': Gauge(
-        'polkadot_state_process_threads',
-        'number threads of a node process',
-        ['name', 'pid']),
-    'polkadot_state_process_memory': Gauge(
-        'polkadot_state_process_memory',
-        'memory is used by a node process',
-        ['name', 'pid']),
-    'polkadot_state_process_cpu_percent': Gauge(
-        'polkadot_state_process_cpu_percent',
-        'memory is used by a node process',
-        ['name', 'pid'])
-}
+PORT = 9110
 
-node_metrics = {
-    'polkadot_state_node_session_key': Gauge(
-        'polkadot_state_node_session_key',
-        'session key of a node',
-        ['name', 'pid', 'session_key'])
-}
 
-PORT = 9110
+class StateCollector:
+    """
+    Exports the snapshot of node processes which was built by the last cycle.
+    A cycle builds a new snapshot and publishes it by replacing the reference, the published snapshot isn't changed,
+    so a scrape never sees a partially updated state.
+    If 'ttl' is set, a scrape runs the cycle when the snapshot is older than 'ttl' seconds.
+    Concurrent scrapes wait for one cycle and share its result
+    """
+
+    def __init__(self):
+        self.snapshot = {}
+        self.ttl = None
+        self.lock = threading.Lock()
+        self.collected_at = None
+        self.duration = None
+
+    def run_cycle(self):
+        start = time.monotonic()
+        update_metrics()
+        self.collected_at = time.monotonic()
+        self.duration = self.collected_at - start
+
+    def refresh(self):
+        with self.lock:
+            if self.collected_at is None or time.monotonic() - self.collected_at >= self.ttl:
+                self.run_cycle()
+
+    def describe(self):
+        return self.families({})
+
+    def collect(self):
+        if self.ttl is not None:
+            self.refresh()
+        families = self.families(self.snapshot)
+        if self.duration is not None:
+            families.append(GaugeMetricFamily('polkadot_state_collection_duration_seconds',
+                                              'duration of the last collection cycle of the state', value=self.duration))
+        return families
+
+    def families(self, snapshot):
+        cmdline = GaugeMetricFamily('polkadot_state_process_cmdline',
+                                    'cmdline of a node process', labels=['name', 'pid', 'cmd_line'])
+        threads = GaugeMetricFamily('polkadot_state_process_threads',
+                                    'number threads of a node process', labels=['name', 'pid'])
+        memory = GaugeMetricFamily('polkadot_state_process_memory',
+                                   'memory is used by a node process', labels=['name', 'pid'])
+        cpu_percent = GaugeMetricFamily('polkadot_state_process_cpu_percent',
+                                        'cpu is used by a node process', labels=['name', 'pid'])
+        cpu = CounterMetricFamily('polkadot_state_process_cpu_seconds',
+                                  'CPU time of a node process', labels=['name', 'pid', 'mode'])
+        ctx_switches = CounterMetricFamily('polkadot_state_process_context_switches',
+                                           'context switches of a node process', labels=['name', 'pid', 'type'])
+        io_bytes = CounterMetricFamily('polkadot_state_process_io_bytes',
+                                       'bytes read and written by a node process', labels=['name', 'pid', 'direction'])
+        open_fds = GaugeMetricFamily('polkadot_state_process_open_fds',
+                                     'open file descriptors of a node process', labels=['name', 'pid'])
+        thread_cpu = CounterMetricFamily('polkadot_state_process_thread_cpu_seconds',
+                                         'CPU time of node process threads with the same name', labels=['name', 'pid', 'thread'])
+        session_key = GaugeMetricFamily('polkadot_state_node_session_key',
+                                        'session key of a node', labels=['name', 'pid', 'session_key'])
+        db_size = GaugeMetricFamily('polkadot_state_node_db_size_bytes',
+                                    'size of the chain database of a node', labels=['name', 'pid', 'database'])
+        db_files = GaugeMetricFamily('polkadot_state_node_db_files',
+                                     'number of files in the chain database of a node', labels=['name', 'pid', 'database'])
+        db_sizes = db_size_tracker.sizes
+        for name, proc in snapshot.items():
+            pid = str(proc['pid'])
+            for database, path in proc['databases'].items():
+                if path in db_sizes:
+                    db_size.add_metric([name, pid, database], db_sizes[path][0])
+                    db_files.add_metric([name, pid, database], db_sizes[path][1])
+            cmdline.add_metric([name, pid, proc['cmd_line']], 1)
+            threads.add_metric([name, pid], proc['threads'])
+            memory.add_metric([name, pid], proc['memory'])
+            cpu_percent.add_metric([name, pid], proc['cpu_percent'])
+            cpu.add_metric([name, pid, 'user'], proc['cpu_user'])
+            cpu.add_metric([name, pid, 'system'], proc['cpu_system'])
+            ctx_switches.add_metric([name, pid, 'voluntary'], proc['ctx_switches'].voluntary)
+            ctx_switches.add_metric([name, pid, 'involuntary'], proc['ctx_switches'].involuntary)
+            # these values can't be read without permissions to the process
+            if proc['io'] is not None:
+                io_bytes.add_metric([name, pid, 'read'], proc['io'].read_bytes)
+                io_bytes.add_metric([name, pid, 'write'], proc['io'].write_bytes)
+            if proc['open_fds'] is not None:
+                open_fds.add_metric([name, pid], proc['open_fds'])
+            for thread, value in proc['thread_cpu'].items():
+                thread_cpu.add_metric([name, pid, thread], value)
+            if proc['session_key']:
+                session_key.add_metric([name, pid, proc['session_key']], 1)
+        return [cmdline, threads, memory, cpu_percent, cpu, ctx_switches, io_bytes, open_fds, thread_cpu, session_key,
+                db_size, db_files]
+
+
+logger = logging.getLogger('state_exporter')
+
+
+def parse_cmdline(cmdline):
+    """
+    Parse the cmdline of a process in a single pass. Returns {flag: value}, the last occurrence of a flag wins
+    """
+    flags = {}
+    for i, arg in enumerate(cmdline):
+        if not arg.startswith('--'):
+            continue
+        if '=' in arg:
+            flag, value = arg.split('=', 1)
+            flags[flag] = value
+        else:
+            flags[arg] = cmdline[i + 1] if i + 1 < len(cmdline) else None
+    return flags
+
+
+class NodeDiscovery:
+    """
+    Finds node processes. A process is inspected only when its pid is seen for the first time,
+    the result is cached until the process dies. Cached processes are checked by (pid, create_time),
+    so a reused pid is inspected again.
+    A process which isn't a node can exec a node later (e.g. a wrapper script), so it's inspected again
+    after 'recheck_interval' seconds.
+    """
+
+    def __init__(self, recheck_interval=60):
+        # pid -> (process, node, inspected_at). The node is None if the process isn't a node
+        self.processes = {}
+        self.recheck_interval = recheck_interval
+
+    def discover(self):
+        pids = psutil.pids()
+        alive = set(pids)
+        for pid in [i for i in self.processes if i not in alive]:
+            del self.processes[pid]
+        now = time.monotonic()
+        nodes = {}
+        # pids are sorted, so a node process replaces its parent (it can be docker, bash, etc.)
+        for pid in pids:
+            cached = self.processes.get(pid)
+            if cached is None or self._expired(cached, now):
+                cached = self._inspect(pid, now)
+            if cached is not None and cached[1] is not None:
+                nodes[cached[1]['name']] = cached[1]
+        return nodes
+
+    def _expired(self, cached, now):
+        if cached[0] is not None and not cached[0].is_running():
+            return True
+        return cached[1] is None and now - cached[2] >= self.recheck_interval
+
+    def _inspect(self, pid, now):
+        proc = None
+        try:
+            proc = psutil.Process(pid)
+            cmdline = proc.cmdline()
+            flags = parse_cmdline(cmdline)
+        except psutil.NoSuchProcess:
+            return None
+        except (psutil.AccessDenied, psutil.ZombieProcess):
+            self.processes[pid] = (proc, None, now)
+            return self.processes[pid]
+        node = None
+        if flags.get('--name') and flags.get('--chain'):
+            node = {'pid': pid,
+                    'name': flags['--name'],
+                    'chain': flags['--chain'],
+                    'cmd_line': ' '.join(cmdline[1:]),
+                    'base_path': flags.get('--base-path'),
+                    'process': proc}
+        self.processes[pid] = (proc, node, now)
+        return self.processes[pid]
+
+
+discovery = NodeDiscovery()
+
+
+def read_thread_name(pid, tid):
+    try:
+        with open('/proc/%d/task/%d/comm' % (pid, tid)) as f:
+            return f.read().strip()
+    except OSError:
+        return 'unknown'
+
+
+def get_thread_cpu(node, threads):
+    """
+    Aggregate CPU time of threads by thread names. CPU time of finished threads is kept,
+    so the values don't decrease when threads exit
+    """
+    known_threads = node.setdefault('threads', {})
+    finished = node.setdefault('finished_threads_cpu', {})
+    live = {}
+    for thread in threads:
+        name = known_threads[thread.id][0] if thread.id in known_threads else read_thread_name(node['pid'], thread.id)
+        live[thread.id] = (name, thread.user_time + thread.system_time)
+    for tid, (name, value) in known_threads.items():
+        if tid not in live:
+            finished[name] = finished.get(name, 0) + value
+    node['threads'] = live
+    totals = dict(finished)
+    for name, value in live.values():
+        totals[name] = totals.get(name, 0) + value
+    return totals
+
+
+def read_process(node):
+    """
+    Read the stats of a node process in one batch. The same Process object is used every cycle,
+    so cpu_percent() is measured from the previous cycle
+    """
+    proc = node['process']
+    with proc.oneshot():
+        cpu_times = proc.cpu_times()
+        stats = {'threads': proc.num_threads(),
+                 'memory': proc.memory_info().rss,
+                 'cpu_percent': proc.cpu_percent(),
+                 'cpu_user': cpu_times.user,
+                 'cpu_system': cpu_times.system,
+                 'ctx_switches': proc.num_ctx_switches()}
+        try:
+            stats['io'] = proc.io_counters()
+            stats['open_fds'] = proc.num_fds()
+        except psutil.AccessDenied:
+            stats['io'] = stats['open_fds'] = None
+        threads = proc.threads()
+    stats['thread_cpu'] = get_thread_cpu(node, threads)
+    return stats
 
 
 def update_metrics():
     processes = {}
 
-    for proc in psutil.process_iter():
+    try:
+        nodes = discovery.discover()
+    except Exception as e:
+        logger.error(e)
+        logger.error(traceback.print_tb(e.__traceback__))
+        return
+    for name, node in nodes.items():
         try:
-            process_cmdline = proc.cmdline()
-            if not (len(process_cmdline) > 1 and '--name' in process_cmdline and '--chain' in process_cmdline):
-                continue
-            process_chain = process_cmdline[::-1][process_cmdline[::-1].index('--chain') - 1]
-            process_name = process_cmdline[::-1][process_cmdline[::-1].index('--name') - 1]
-            process_pid = proc.pid
-            process_base_path = process_cmdline[::-1][process_cmdline[::-1].index('--base-path') - 1]\
-                if '--base-path' in process_cmdline else None
-            # It will delete the previous process if
-            # it's the parent of the current process (it can be docker, bash, etc.)
-            if process_name in processes and processes[process_name]['pid'] < process_pid:
-                del processes[process_name]
-            processes[process_name] = {'pid': process_pid,
-                                       'chain': process_chain,
-                                       'cmd_line': ' '.join(process_cmdline[1:]),
-                                       'threads': proc.num_threads(),
-                                       'memory': proc.memory_info().rss,
-                                       'cpu_percent': proc.cpu_percent(),
-                                       'base_path': process_base_path
-                                       }
+            processes[name] = {'pid': node['pid'],
+                               'chain': node['chain'],
+                               'cmd_line': node['cmd_line'],
+                               'base_path': node['base_path'],
+                               **read_process(node)
+                               }
         except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
             pass
         except Exception as e:
             logger.error(e)
             logger.error(traceback.print_tb(e.__traceback__))
             return
+    for proc in processes.values():
+        proc['session_key'] = None
+        proc['databases'] = {}
+        if proc['base_path'] and proc['chain'] in node_chain_folders:
+            chain_path = os.path.join(proc['base_path'], 'chains', node_chain_folders[proc['chain']])
+            proc['databases'] = {i: os.path.join(chain_path, i) for i in ('db', 'paritydb')}
+            keystore_path = os.path.join(chain_path, 'keystore')
+            try:
+                proc['session_key'] = keystore_cache.get(keystore_path)
+            except Exception as e:
+                logger.error(e)
+                logger.error(traceback.print_tb(e.__traceback__))
     logger.debug('processes were found: ' + str(processes))
+    db_size_tracker.paths = frozenset(j for i in processes.values() for j in i['databases'].values())
+    # publish the new snapshot, series of processes which are gone disappear with the old one
+    state_collector.snapshot = processes
 
-    try:
-        # wipe metrics
-        for metric in {**process_metrics, **node_metrics}.items():
-            for sample in metric[1].collect()[0].samples:
-                metric[1].remove(*list(sample.labels.values()))
-
-        for proc in processes:
-            process_metrics['polkadot_state_process_cmdline'].labels(
-                name=proc,
-                pid=processes[proc]['pid'],
-                cmd_line=processes[proc]['cmd_line']).set(1)
-            process_metrics['polkadot_state_process_threads'].labels(
-                name=proc,
-                pid=processes[proc]['pid']).set(processes[proc]['threads'])
-            process_metrics['polkadot_state_process_memory'].labels(
-                name=proc,
-                pid=processes[proc]['pid']).set(processes[proc]['memory'])
-            process_metrics['polkadot_state_process_cpu_percent'].labels(
-                name=proc,
-                pid=processes[proc]['pid']).set(processes[proc]['cpu_percent'])
-            if processes[proc]['base_path']:
-                keystore_path = os.path.join(
-                    processes[proc]['base_path'],
-                    'chains',
-                    node_chain_folders[processes[proc]['chain']],
-                    'keystore')
-                node_session_key = parse_session_key(keystore_path)
-                if node_session_key:
-                    node_metrics['polkadot_state_node_session_key'].labels(
-                        name=proc,
-                        pid=processes[proc]['pid'],
-                        session_key=node_session_key).set(1)
-    except Exception as e:
-        logger.error(e)
-        logger.error(traceback.print_tb(e.__traceback__))
-        return
+
+class DatabaseSizeTracker:
+    """
+    Tracks sizes of node databases in a background thread. The totals of every directory are cached
+    and a directory is listed again only if its mtime changes. Files can grow in place without changing
+    the mtime of the directory, so all directories are listed again every 'rescan_interval' seconds.
+    The number of stat calls is limited by 'stat_rate' per second
+    """
+
+    def __init__(self, interval=60, rescan_interval=3600, stat_rate=10000):
+        self.interval = interval
+        self.rescan_interval = rescan_interval
+        self.stat_rate = stat_rate
+        # database paths of the last cycle
+        self.paths = frozenset()
+        # database path -> (size, files), it's replaced by every update
+        self.sizes = {}
+        # directory -> (mtime_ns, size of files, number of files, subdirectories)
+        self.dirs = {}
+        self.last_rescan = None
+        self.budget = stat_rate
+        self.budget_start = time.monotonic()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            rescan = self.last_rescan is None or time.monotonic() - self.last_rescan >= self.rescan_interval
+            try:
+                self.update(rescan)
+            except Exception as e:
+                logger.error(e)
+                logger.error(traceback.print_tb(e.__traceback__))
+            if rescan:
+                self.last_rescan = time.monotonic()
+            time.sleep(self.interval)
+
+    def update(self, rescan=False):
+        sizes = {}
+        seen = set()
+        for path in self.paths:
+            try:
+                if os.path.isdir(path):
+                    sizes[path] = self._scan(path, rescan, seen)
+            except OSError as e:
+                logger.debug('the size of the database ' + path + " can't be read: " + str(e))
+        # forget removed directories
+        self.dirs = {k: v for k, v in self.dirs.items() if k in seen}
+        self.sizes = sizes
+        logger.debug('database sizes were updated: ' + str(sizes))
+
+    def _spend(self, stats):
+        self.budget -= stats
+        if self.budget <= 0:
+            elapsed = time.monotonic() - self.budget_start
+            if elapsed < 1:
+                time.sleep(1 - elapsed)
+            self.budget = self.stat_rate
+            self.budget_start = time.monotonic()
+
+    def _scan(self, path, rescan, seen):
+        seen.add(path)
+        # the mtime is read before the listing, so changes during the listing are caught by the next update
+        mtime = os.stat(path).st_mtime_ns
+        self._spend(1)
+        cached = self.dirs.get(path)
+        if rescan or cached is None or cached[0] != mtime:
+            size = files = 0
+            subdirs = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        try:
+                            size += entry.stat(follow_symlinks=False).st_size
+                            files += 1
+                        except FileNotFoundError:
+                            pass
+                        self._spend(1)
+            cached = (mtime, size, files, subdirs)
+            self.dirs[path] = cached
+        total_size, total_files = cached[1], cached[2]
+        for subdir in cached[3]:
+            try:
+                subdir_size, subdir_files = self._scan(subdir, rescan, seen)
+            except FileNotFoundError:
+                continue
+            total_size += subdir_size
+            total_files += subdir_files
+        return total_size, total_files
+
+
+db_size_tracker = DatabaseSizeTracker()
+
+state_collector = StateCollector()
+REGISTRY.register(state_collector)
+
+
+# variants of key prefixes in the right order
+key_formats = (
+    ['6772616e', '62616265', '696d6f6e', '70617261', '61756469'], # v1 validator keys (gran,babe,imon,para,audi)
+    ['6772616e', '62616265', '696d6f6e', '70617261', '6173676e', '61756469'], # v2 validator keys (gran,babe,imon,para,asgn,audi)
+    ['6772616e', '62616265', '696d6f6e', '70617261', '6173676e', '61756469', '62656566'], # v3 validator keys (gran,babe,imon,para,asgn,audi,beef)
+    ['6772616e', '62616265', '70617261', '6173676e', '61756469', '62656566'], # v4 validator keys (gran,babe,para,asgn,audi,beef)
+    ['61757261'] # collator keys (aura)
+)
+possible_prefixes = set([j for i in key_formats for j in i])
 
 
 def parse_session_key(dir):
-    # variants of key prefixes in the right order
-    key_formats = (
-        ['6772616e', '62616265', '696d6f6e', '70617261', '61756469'], # v1 validator keys (gran,babe,imon,para,audi)
-        ['6772616e', '62616265', '696d6f6e', '70617261', '6173676e', '61756469'], # v2 validator keys (gran,babe,imon,para,asgn,audi)
-        ['6772616e', '62616265', '696d6f6e', '70617261', '6173676e', '61756469', '62656566'], # v3 validator keys (gran,babe,imon,para,asgn,audi,beef)
-        ['6772616e', '62616265', '70617261', '6173676e', '61756469', '62656566'], # v4 validator keys (gran,babe,para,asgn,audi,beef)
-        ['61757261'] # collator keys (aura)
-    )
-    possible_prefixes = list(set([j for i in key_formats for j in i]))
-    if os.path.isdir(dir):
-        os.chdir(dir)
-        files = os.listdir('.')
-        files = [i for i in files if len(i) in [72, 74] and i[0:8] in possible_prefixes]
-        if not files:
-            return None
-        # find creation time of the newest key
-        time_of_last_key = sorted(list(set([int(os.path.getmtime(i)) for i in files])))[-1]
-        # parse the newest public keys and prefix them with the names of files.
-        # make sure to only pick up the keys created within 60 seconds interval
-        keys = {i[0:8]: i[8:] for i in files if int(os.path.getmtime(i)) <= time_of_last_key and int(os.path.getmtime(i)) > time_of_last_key - 60}
-        logger.debug('keys were found: ' + str(keys) + ' in the keystore path: ' + dir)
-        for key_format in key_formats:
-            if set(keys.keys()) == set(key_format):
-                # build the session key
-                session_key = '0x' + ''.join([keys[i] for i in key_format])
-                logger.debug('the session key was parsed: ' + session_key + ' in the keystore path: ' + dir)
-                return(session_key)
-        logger.error('Error parsing the session key')
+    try:
+        # one pass over the directory, the mtime of every key file is read once
+        with os.scandir(dir) as entries:
+            files = {i.name: int(i.stat().st_mtime) for i in entries
+                     if len(i.name) in [72, 74] and i.name[0:8] in possible_prefixes}
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    if not files:
+        return None
+    # find creation time of the newest key
+    time_of_last_key = max(files.values())
+    # parse the newest public keys and prefix them with the names of files.
+    # make sure to only pick up the keys created within 60 seconds interval
+    keys = {i[0:8]: i[8:] for i, mtime in files.items() if time_of_last_key - 60 < mtime <= time_of_last_key}
+    logger.debug('keys were found: ' + str(keys) + ' in the keystore path: ' + dir)
+    for key_format in key_formats:
+        if set(keys.keys()) == set(key_format):
+            # build the session key
+            session_key = '0x' + ''.join([keys[i] for i in key_format])
+            logger.debug('the session key was parsed: ' + session_key + ' in the keystore path: ' + dir)
+            return(session_key)
+    logger.error('Error parsing the session key')
     return None
 
 
+class KeystoreCache:
+    """
+    Session keys of keystores. A keystore is parsed again only if the mtime or the inode of its directory changes,
+    adding, removing or renaming a key file updates the mtime of the directory
+    """
+
+    def __init__(self):
+        # keystore path -> ((mtime_ns, inode), session key)
+        self.keystores = {}
+
+    def get(self, dir):
+        try:
+            stat = os.stat(dir)
+        except OSError:
+            self.keystores.pop(dir, None)
+            return None
+        version = (stat.st_mtime_ns, stat.st_ino)
+        cached = self.keystores.get(dir)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        session_key = parse_session_key(dir)
+        self.keystores[dir] = (version, session_key)
+        return session_key
+
+
+keystore_cache = KeystoreCache()
+
+
 if __name__ == '__main__':
-    global logger
-    logger = logging.getLogger('state_exporter')
+    parser = argparse.ArgumentParser(description='Exporter of the state of polkadot nodes')
+    parser.add_argument('debug', nargs='?', choices=['debug'], help='enable debug logging')
+    parser.add_argument('--mode', choices=['schedule', 'scrape'], default='schedule',
+                        help="'schedule' collects the state every '--interval' seconds, "
+                             "'scrape' collects it on scrapes if it's older than '--ttl' seconds")
+    parser.add_argument('--interval', type=int, default=10, help='collection interval of the schedule mode')
+    parser.add_argument('--ttl', type=float, default=5, help='minimal age of the state to collect it again in the scrape mode')
+    parser.add_argument('--discovery-recheck-interval', type=int, default=60,
+                        help='interval of inspecting again processes which are not nodes')
+    parser.add_argument('--db-size-interval', type=int, default=60, help='interval of database size updates')
+    parser.add_argument('--db-size-rescan-interval', type=int, default=3600,
+                        help='interval of full database rescans which catch files growing in place')
+    parser.add_argument('--db-size-stat-rate', type=int, default=10000,
+                        help='maximal number of stat calls per second of database size updates')
+    args = parser.parse_args()
 
     # console handler
     ch = logging.StreamHandler()
-    if len(sys.argv) > 1 and sys.argv[1] == 'debug':
+    if args.debug:
         logger.setLevel(logging.DEBUG)
     else:
         logger.setLevel(logging.INFO)
@@ -165,9 +482,21 @@ if __name__ == '__main__':
     ch.setFormatter(formatter)
     logger.addHandler(ch)
 
-    # Start up the server to expose the metrics
-    start_http_server(PORT)  # Metrics server
-    schedule.every(10).seconds.do(update_metrics)
-    while True:
-        schedule.run_pending()
-        time.sleep(1)
+    discovery.recheck_interval = args.discovery_recheck_interval
+    db_size_tracker.interval = args.db_size_interval
+    db_size_tracker.rescan_interval = args.db_size_rescan_interval
+    db_size_tracker.stat_rate = args.db_size_stat_rate
+    db_size_tracker.start()
+
+    if args.mode == 'scrape':
+        # the state is collected by scrapes, the main thread only has to keep the process alive
+        state_collector.ttl = args.ttl
+        start_http_server(PORT)  # Metrics server
+        threading.Event().wait()
+    else:
+        # Start up the server to expose the metrics
+        start_http_server(PORT)  # Metrics server
+        schedule.every(args.interval).seconds.do(state_collector.run_cycle)
+        while True:
+            schedule.run_pending()
+            time.sleep(1)
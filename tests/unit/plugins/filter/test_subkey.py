@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2022, Devops Parity <devops@parity.io>
+# GPL-2.0-or-later
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import shutil
+
+import pytest
+
+from ansible_collections.paritytech.chain.plugins.filter import subkey
+
+pytestmark = pytest.mark.skipif(not subkey.python_substrateinterface_installed,
+                                reason='substrate-interface is required for the native backend')
+
+# the key of the example in plugins/README.md, the addresses are the output of subkey
+PUBLIC_KEY = '0x1e3a41ed0424929e949c531654b82baee9869bcea16d1115ca8344b637a44b10'
+SEED = '0xa021a8ab1f9a1b5dd293f56978b64531ec68db5b028197c2577417a24d4fa383'
+MNEMONIC = 'bottom drive obey lake curtain smoke basket hold race lonely fit walk'
+
+
+@pytest.mark.parametrize('network, network_id, address', [
+    ('', 'substrate', '5CkLbjyxrLAs8GJNwhaDLtGdhvsFWyS3N6MqSANsz4y37Moi'),
+    ('kusama', 'kusama', 'DFxG4KqUhBnsv7piQPGEqddrX9VKeFDpUCappeqTsBXrN2H'),
+])
+def test_native_public_key(network, network_id, address):
+    assert subkey._native_inspect(PUBLIC_KEY, network=network, public=True) == {
+        'accountId': PUBLIC_KEY,
+        'networkId': network_id,
+        'publicKey': PUBLIC_KEY,
+        'ss58Address': address,
+        'ss58PublicKey': address,
+    }
+
+
+def test_native_secret_fields():
+    output = subkey._native_inspect(SEED, network='polkadot')
+    assert sorted(output) == ['accountId', 'networkId', 'publicKey', 'secretKeyUri', 'secretSeed', 'ss58Address',
+                              'ss58PublicKey']
+    assert output['networkId'] == 'polkadot'
+    assert output['ss58PublicKey'] == output['ss58Address']
+
+
+@pytest.mark.parametrize('network', ['westend', 'rococo', 'Polkadot', 'KUSAMA'])
+def test_native_leaves_unknown_networks_to_subkey(network):
+    with pytest.raises(subkey.UnsupportedInput):
+        subkey._native_inspect(PUBLIC_KEY, network=network, public=True)
+    with pytest.raises(subkey.AnsibleFilterError):
+        subkey.subkey_inspect(PUBLIC_KEY, network=network, public=True, backend='native')
+
+
+@pytest.mark.skipif(shutil.which('subkey') is None, reason='the subkey binary is required')
+@pytest.mark.parametrize('uri, network, scheme, public', [
+    (SEED, '', 'sr25519', False),
+    (SEED, 'kusama', 'ed25519', False),
+    (MNEMONIC, 'polkadot', 'sr25519', False),
+    (MNEMONIC, 'substrate', 'ed25519', False),
+    (PUBLIC_KEY, '', 'sr25519', True),
+    (PUBLIC_KEY, 'polkadot', 'sr25519', True),
+    ('5CkLbjyxrLAs8GJNwhaDLtGdhvsFWyS3N6MqSANsz4y37Moi', 'kusama', 'sr25519', True),
+    (SEED, 'kusama', 'SR25519', False),
+])
+def test_native_matches_subkey(uri, network, scheme, public):
+    # secret seeds of sr25519 keys are the mini secret keys in both backends
+    assert subkey._native_inspect(uri, network, scheme, public) == subkey._run_subkey_inspect(uri, network, scheme, public)
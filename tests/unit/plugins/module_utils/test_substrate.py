@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2022, Devops Parity <devops@parity.io>
+# GPL-2.0-or-later
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import os
+
+import pytest
+
+from ansible_collections.paritytech.chain.plugins.module_utils import substrate
+
+pytestmark = pytest.mark.skipif(not substrate.python_substrateinterface_installed,
+                                reason='substrate-interface is required for the metadata cache')
+
+GENESIS_HASH = '0x91b171bb158e2d3848fa23a9f1c25182fb8e20313b2c1eb49219da7a70ce90c3'
+KEY = 'METADATA_1000000'
+
+
+class FakeScaleObject:
+    def __init__(self, data):
+        self.data = data
+        self.decoded = False
+
+    def decode(self):
+        self.decoded = True
+
+
+class FakeRuntimeConfig:
+    def create_scale_object(self, type_string, data):
+        assert type_string == 'MetadataVersioned'
+        return FakeScaleObject(data)
+
+
+class FakeSubstrate:
+    runtime_config = FakeRuntimeConfig()
+
+
+def test_second_run_loads_metadata_from_cache(tmp_path):
+    # the first run downloads the metadata and stores it
+    first_run = substrate.MetadataFileCache(str(tmp_path), GENESIS_HASH, FakeSubstrate())
+    assert first_run.get(KEY) is None
+    first_run.set(KEY, FakeScaleObject(substrate.ScaleBytes(bytearray(b'\x6d\x65\x74\x61\x0e'))))
+    assert first_run.stats['misses'] == 1
+
+    # a new run decodes the stored bytes instead of downloading them
+    second_run = substrate.MetadataFileCache(str(tmp_path), GENESIS_HASH, FakeSubstrate())
+    metadata = second_run.get(KEY)
+    assert metadata is not None and metadata.decoded
+    assert bytes(metadata.data.data) == b'\x6d\x65\x74\x61\x0e'
+    assert second_run.stats == {'path': os.path.join(str(tmp_path), GENESIS_HASH), 'hits': 1, 'misses': 0}
+
+
+def test_metadata_is_not_loaded_from_writable_directory(tmp_path):
+    cache = substrate.MetadataFileCache(str(tmp_path), GENESIS_HASH, FakeSubstrate())
+    cache.set(KEY, FakeScaleObject(substrate.ScaleBytes(bytearray(b'\x6d\x65\x74\x61\x0e'))))
+    os.chmod(cache.path, 0o777)
+    assert cache.get(KEY) is None
+    assert cache.stats['misses'] == 1
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+
+# Copyright: (c) 2022, Devops Parity <devops@parity.io>
+# GPL-2.0-or-later
+from __future__ import (absolute_import, division, print_function)
+
+__metaclass__ = type
+
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from ansible_collections.paritytech.chain.plugins.modules import chain_restore_http
+
+CONTENT = bytes(range(256)) * 64
+
+
+class BackupHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _status(self):
+        self.server.requests.append((self.command, self.path, self.headers.get('Range')))
+        if self.server.failures.get(self.path, 0) > 0:
+            self.server.failures[self.path] -= 1
+            return 503, None
+        if self.path not in self.server.files:
+            return 404, None
+        return 200, self.server.files[self.path]
+
+    def do_HEAD(self):
+        status, data = self._status()
+        self.send_response(status)
+        if data is not None and self.server.head_length:
+            self.send_header('Content-Length', str(len(data)))
+        else:
+            self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+
+    def do_GET(self):
+        status, data = self._status()
+        if data is None:
+            self.send_response(status)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        offset = int(self.headers['Range'][6:-1]) if self.headers.get('Range') else 0
+        if offset >= len(data) > 0:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % len(data))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206 if offset else 200)
+        if offset:
+            self.send_header('Content-Range', 'bytes %d-%d/%d' % (offset, len(data) - 1, len(data)))
+        self.send_header('Content-Length', str(len(data) - offset))
+        self.end_headers()
+        self.wfile.write(data[offset:])
+
+
+class FakeModule:
+    check_mode = False
+
+    def __init__(self, **params):
+        self.params = dict(jobs=2, retries=2, timeout=10, verify_existing='size', validate_certs=True,
+                           owner=None, group=None, **params)
+
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(chain_restore_http.time, 'sleep', lambda seconds: None)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), BackupHandler)
+    httpd.files, httpd.failures, httpd.requests, httpd.head_length = {}, {}, [], True
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    httpd.url = 'http://127.0.0.1:%d/backup/20230101-000000' % httpd.server_address[1]
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def restore(server, dest):
+    module = FakeModule(url=server.url, dest=str(dest))
+    pool = chain_restore_http.ConnectionPool(10, True)
+    run = chain_restore_http.Restore(module, pool, str(dest))
+    source, files = run.retry(chain_restore_http.get_file_list, pool, server.url)
+    for entry in files:
+        run.download(entry)
+    return source, run.stats
+
+
+def files_txt(server):
+    server.files['/backup/20230101-000000/files.txt'] = b'db/000001.sst\n'
+    server.files['/backup/20230101-000000/db/000001.sst'] = CONTENT
+
+
+def test_files_txt_partial_file_is_resumed(server, tmp_path):
+    files_txt(server)
+    (tmp_path / 'db').mkdir()
+    (tmp_path / 'db' / '000001.sst.partial').write_bytes(CONTENT[:1000])
+
+    source, stats = restore(server, tmp_path)
+    assert source == 'files.txt'
+    assert (tmp_path / 'db' / '000001.sst').read_bytes() == CONTENT
+    assert not (tmp_path / 'db' / '000001.sst.partial').exists()
+    assert stats['resumed_files'] == 1 and stats['downloaded_bytes'] == len(CONTENT) - 1000
+    assert ('GET', '/backup/20230101-000000/db/000001.sst', 'bytes=1000-') in server.requests
+
+
+def test_files_txt_stale_partial_file_is_downloaded_again(server, tmp_path):
+    # a partial file which is longer than the file is answered with 416, it isn't complete
+    files_txt(server)
+    (tmp_path / 'db').mkdir()
+    (tmp_path / 'db' / '000001.sst.partial').write_bytes(CONTENT + b'stale')
+
+    source, stats = restore(server, tmp_path)
+    assert (tmp_path / 'db' / '000001.sst').read_bytes() == CONTENT
+    assert stats['resumed_files'] == 0 and stats['downloaded_bytes'] == len(CONTENT)
+
+
+@pytest.mark.parametrize('existing, skipped', [(CONTENT, 1), (CONTENT[:1000], 0)], ids=['complete', 'truncated'])
+def test_files_txt_existing_file_is_checked_by_size(server, tmp_path, existing, skipped):
+    files_txt(server)
+    (tmp_path / 'db').mkdir()
+    (tmp_path / 'db' / '000001.sst').write_bytes(existing)
+
+    source, stats = restore(server, tmp_path)
+    assert (tmp_path / 'db' / '000001.sst').read_bytes() == CONTENT
+    assert stats['skipped_files'] == skipped and stats['downloaded_files'] == 1 - skipped
+
+
+def test_files_txt_file_of_unknown_size_is_downloaded_again(server, tmp_path):
+    files_txt(server)
+    server.head_length = False
+    (tmp_path / 'db').mkdir()
+    (tmp_path / 'db' / '000001.sst').write_bytes(CONTENT[:1000])
+    (tmp_path / 'db' / '000001.sst.partial').write_bytes(CONTENT[:2000])
+
+    source, stats = restore(server, tmp_path)
+    assert (tmp_path / 'db' / '000001.sst').read_bytes() == CONTENT
+    assert stats['resumed_files'] == 0 and stats['downloaded_bytes'] == len(CONTENT)
+
+
+def test_manifest_is_retried(server, tmp_path):
+    server.files['/backup/20230101-000000/manifest.json'] = json.dumps({'files': [
+        {'path': 'db/000001.sst', 'object': 'objects/ab/ab12', 'size': len(CONTENT),
+         'hash': hashlib.sha256(CONTENT).hexdigest()},
+    ]}).encode()
+    server.files['/backup/objects/ab/ab12'] = CONTENT
+    server.failures['/backup/20230101-000000/manifest.json'] = 1
+    (tmp_path / 'db').mkdir()
+    (tmp_path / 'db' / '000001.sst.partial').write_bytes(CONTENT[:1000])
+
+    source, stats = restore(server, tmp_path)
+    assert source == 'manifest.json'
+    assert (tmp_path / 'db' / '000001.sst').read_bytes() == CONTENT
+    assert stats['retries'] == 1 and stats['resumed_files'] == 1
+    # the size is known from the manifest
+    assert not [i for i in server.requests if i[0] == 'HEAD']